@@ -0,0 +1,519 @@
+#!/usr/bin/env python
+"""
+Offline end-to-end benchmark of sdkBuildManager.
+
+Stub docker and helm executables are generated and put first on
+PATH, so no daemon, registry or network is needed. Their latency per call
+and the number of output lines they print are configurable. A synthetic
+SDK is generated in a scratch directory: a template archive, an
+sdk_input_path tree with N charts of M RPMs each and large values files,
+an integration chart and a docker save archive.
+
+The following runs are timed, each in a fresh process of the tool with an
+isolated HOME:
+
+    generate_chart_cold  --build-load-images into an empty output directory
+    generate_chart_warm  the same again, with the stage caches populated
+    rebuild_csar         --rebuild-csar of an integration chart
+    rebuild_csar_native  --rebuild-csar --csar-light with the native writer
+    load_csar_images     --load-csar-images of the docker archive
+    yaml_merge           in-process load, merge and dump of the values files
+
+Results are written as JSON. Given a baseline written by an earlier run,
+every benchmark whose median is more than --threshold slower than the
+baseline is reported and the script exits with status 1.
+
+    python benchmarks/bench_sdk_build.py [--charts N] [--rpms M]
+        [--latency S] [--output-lines L] [--repeat R]
+        [--out results.json] [--baseline old.json] [--threshold 0.2]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from os.path import abspath, dirname, join
+
+ROOT = abspath(join(dirname(__file__), '..'))
+TOOL = join(ROOT, 'src', 'sdkBuildManager.py')
+sys.path.insert(0, join(ROOT, 'src'))
+
+import sdkBuildManager  # noqa: E402
+
+SHIM_COMMON = '''#!{python}
+import fcntl, hashlib, json, os, sys, time
+args = sys.argv[1:]
+time.sleep(float(os.environ.get('SHIM_LATENCY', '0')))
+# queries whose output the tool parses stay quiet
+if args[:2] not in (['image', 'ls'], ['image', 'inspect']):
+    for _line in range(int(os.environ.get('SHIM_OUTPUT_LINES', '0'))):
+        print('{name} output line', _line, 'x' * 60)
+'''
+
+DOCKER_SHIM = '''
+state_file = os.environ['SHIM_STATE']
+lock = open(state_file + '.lock', 'w')
+fcntl.flock(lock, fcntl.LOCK_EX)
+state = {'tags': {}, 'labels': {}}
+if os.path.exists(state_file):
+    with open(state_file) as _reader:
+        state = json.load(_reader)
+
+
+def save():
+    with open(state_file, 'w') as _writer:
+        json.dump(state, _writer)
+
+
+def norm(tag):
+    return tag if ':' in tag.rsplit('/', 1)[-1] else tag + ':latest'
+
+
+def option(name):
+    return args[args.index(name) + 1] if name in args else None
+
+
+if args[:1] == ['build']:
+    labels = [args[i + 1] for i, x in enumerate(args) if x == '--label']
+    tag = option('-t')
+    image_id = 'sha256:' + hashlib.sha256(
+        (tag + repr(labels) + str(time.time())).encode()).hexdigest()
+    state['tags'][norm(tag)] = image_id
+    state['labels'][image_id] = labels
+    save()
+elif args[:1] == ['tag']:
+    image_id = state['tags'].get(norm(args[1]))
+    if not image_id and args[1].startswith('sha256:'):
+        image_id = args[1]
+    if not image_id:
+        sys.exit('No such image: ' + args[1])
+    state['tags'][norm(args[2])] = image_id
+    save()
+elif args[:2] == ['image', 'ls'] or args[:1] == ['images']:
+    filters = [args[i + 1][len('label='):] for i, x in enumerate(args)
+               if x == '--filter']
+    fmt = option('--format')
+    for tag, image_id in sorted(state['tags'].items()):
+        if not all(_f in state['labels'].get(image_id, [])
+                   for _f in filters):
+            continue
+        if '--quiet' in args:
+            print(image_id)
+        elif fmt:
+            repository, version = tag.rsplit(':', 1)
+            print(fmt.replace('{{.Repository}}', repository)
+                  .replace('{{.Tag}}', version).replace('{{.ID}}', image_id))
+        else:
+            print(tag, image_id)
+elif args[:2] == ['image', 'inspect']:
+    image_id = state['tags'].get(norm(args[-1]))
+    if not image_id:
+        sys.exit('No such image: ' + args[-1])
+    fmt = option('--format')
+    if fmt:
+        print(fmt.replace('{{.Id}}', image_id).replace(
+            '{{.Size}}', os.environ.get('SHIM_IMAGE_SIZE', '104857600')))
+    else:
+        print(json.dumps([{'Id': image_id}]))
+elif args[:1] == ['rmi']:
+    for tag in [x for x in args[1:] if not x.startswith('-')]:
+        state['tags'].pop(norm(tag), None)
+    save()
+elif args[:1] == ['load']:
+    import tarfile
+    source = open(option('--input'), 'rb') if option('--input') \\
+        else sys.stdin.buffer
+    with tarfile.open(fileobj=source, mode='r|') as archive:
+        for member in archive:
+            if member.name != 'manifest.json':
+                continue
+            for entry in json.load(archive.extractfile(member)):
+                for tag in entry.get('RepoTags') or []:
+                    state['tags'][norm(tag)] = 'sha256:' + \\
+                        entry['Config'].split('/')[-1].split('.')[0]
+                    print('Loaded image:', tag)
+    save()
+elif args[:1] == ['run'] and 'generate' in args:
+    import zipfile
+    vnfd = 'Definitions/' + os.path.basename(option('--vnfd'))
+    with zipfile.ZipFile(join(option('-w'), option('--name') + '.csar'),
+                         'w', zipfile.ZIP_DEFLATED) as csar:
+        csar.writestr('TOSCA-Metadata/TOSCA.meta',
+                      'Entry-Definitions: {0}\\n'.format(vnfd))
+        csar.write(option('--vnfd'), vnfd)
+        for chart in os.listdir(option('--helm-dir')):
+            csar.write(join(option('--helm-dir'), chart),
+                       'Definitions/OtherTemplates/' + chart)
+'''
+
+HELM_SHIM = '''
+import re, tarfile
+args = [x for x in args if x != '--debug']
+if args[0] == 'package':
+    chart, output = args[1], args[args.index('-d') + 1]
+    with open(os.path.join(chart, 'Chart.yaml')) as _reader:
+        text = _reader.read()
+    name = re.search(r'^name: *(\\S+)', text, re.M).group(1)
+    version = re.search(r'^version: *(\\S+)', text, re.M).group(1)
+    with tarfile.open(os.path.join(output, '{0}-{1}.tgz'.format(
+            name, version.strip('\\'"'))), 'w:gz') as archive:
+        archive.add(chart, arcname=name)
+elif args[0] == 'dependency':
+    chart = args[-1]
+    os.makedirs(os.path.join(chart, 'charts'), exist_ok=True)
+    with open(os.path.join(chart, 'Chart.lock'), 'w') as _writer:
+        _writer.write('dependencies: []\\n')
+'''
+
+TEMPLATE_CHART = 'eric-enmsg-custom-fm-oneflow'
+MODELS_DIR = 'eric-enm-custom-models-fm-oneflow'
+AM_PACKAGE_MANAGER = ('armdocker.rnd.ericsson.se/proj-am/releases/'
+                      'eric-am-package-manager:2.62.0-1')
+
+
+def write(path, data):
+    os.makedirs(dirname(path), exist_ok=True)
+    with open(path, 'wb' if isinstance(data, bytes) else 'w') as _writer:
+        _writer.write(data)
+
+
+def dump_yaml(path, data):
+    write(path, sdkBuildManager.YAML_ENGINE.dump(data, None))
+
+
+def write_shims(bin_dir):
+    for name, body in [('docker', DOCKER_SHIM), ('helm', HELM_SHIM)]:
+        path = join(bin_dir, name)
+        write(path, SHIM_COMMON.format(python=sys.executable, name=name) +
+              'from os.path import join\n' + body)
+        os.chmod(path, 0o755)
+
+
+def values_document(name, keys):
+    return {
+        'images': {name: {'name': name, 'tag': '1.0.0'},
+                   'eric-enm-monitoring': {'name': 'eric-enm-monitoring-eap7',
+                                           'tag': '1.0.0'}},
+        'replicas-' + name: 1,
+        'service': {'name': name, 'sgname': name},
+        'global': {'registry': {'url': 'armdocker.rnd.ericsson.se'}},
+        'imageCredentials': {'repoPath': 'proj-enm'},
+        'settings': {'key{0}'.format(_i): {'value': _i,
+                                           'list': [_i, 'item', True],
+                                           'text': 'x' * 40}
+                     for _i in range(keys)},
+    }
+
+
+def make_templates(root, values_keys):
+    templates = join(root, 'templates')
+    chart = join(templates, 'chart', TEMPLATE_CHART)
+    write(join(chart, 'Chart.yaml'),
+          'apiVersion: v2\nname: {0}\nversion: 1.0.0\n'
+          'description: Benchmark chart\n'.format(TEMPLATE_CHART))
+    dump_yaml(join(chart, 'values.yaml'),
+              values_document(TEMPLATE_CHART, values_keys))
+    for name in ['eric_ingress.yaml', 'eric_ingress_ipv6.yaml',
+                 'svc_ipv6.yaml', 'deployment.yaml']:
+        write(join(chart, 'templates', name),
+              'name: {0}\n'.format(TEMPLATE_CHART))
+    write(join(chart, 'appconfig', 'configmaps', 'globalproperties.yaml'),
+          'global.properties: |\n  a=b\n')
+    dump_yaml(join(chart, 'appconfig', 'volumes.yaml'),
+              [{'name': 'gp', 'configMap': {'name': 'gp'}}])
+    write(join(templates, 'image_content', 'README'), 'image content\n')
+    write(join(templates, 'Dockerfile'),
+          'ARG ERIC_ENM_FMSDK_IMAGE_REPO=repo\n'
+          'ARG ERIC_ENM_FMSDK_IMAGE_TAG=tag\n'
+          'FROM ${ERIC_ENM_FMSDK_IMAGE_REPO}/eric-enm-fmsdk:'
+          '${ERIC_ENM_FMSDK_IMAGE_TAG}\n'
+          'COPY image_content/*.rpm /var/tmp/\n')
+    models = join(templates, MODELS_DIR)
+    os.makedirs(join(models, 'image_content'), exist_ok=True)
+    os.makedirs(join(models, 'image_content_removemodels'), exist_ok=True)
+    for name, source in [('Dockerfile', 'image_content/'),
+                         ('Dockerfile-RemoveModels',
+                          'image_content_removemodels/*.rpm')]:
+        write(join(models, name),
+              'ARG ERIC_ENM_MODELS_CORE_IMAGE_REPO=repo\n'
+              'ARG ERIC_ENM_MODELS_CORE_IMAGE_TAG=tag\n'
+              'FROM ${ERIC_ENM_MODELS_CORE_IMAGE_REPO}/models:'
+              '${ERIC_ENM_MODELS_CORE_IMAGE_TAG}\n'
+              'COPY ' + source + ' /var/tmp/models/\n')
+
+    archive = join(root, 'fm-sdk-templates.tgz')
+    with tarfile.open(archive, 'w:gz') as _tar:
+        _tar.add(templates, arcname='templates')
+    shutil.rmtree(templates)
+    return archive
+
+
+def make_inputs(root, charts, rpms, rpm_size, values_keys):
+    inputs = join(root, 'fmsdk')  # the SDK type is taken from this name
+    names = []
+    for index in range(charts):
+        name = 'eric-enmsg-bench{0}'.format(index)
+        names.append(name)
+        chart = join(inputs, name)
+        version = '1.0.{0}'.format(index)
+        dump_yaml(join(chart, 'config', 'build.yaml'), {
+            name: {'chart-version': version, 'image-version': version},
+            'eric-enm-fmsdk': {'image-version': '2.0.0'}})
+        values = values_document(name, values_keys)
+        values['replicas-' + name] = 2
+        dump_yaml(join(chart, 'config', 'values.yaml'), values)
+        dump_yaml(join(chart, 'config', 'volumes.yaml'),
+                  [{'name': 'extra', 'emptyDir': {}}])
+        write(join(chart, 'config', 'global-properties.json'),
+              json.dumps({'key{0}'.format(_i): 'value'
+                          for _i in range(50)}))
+        for folder in ['jboss', 'models', 'uninstall']:
+            for rpm in range(rpms):
+                write(join(chart, folder, '{0}-{1}-{2}.rpm'.format(
+                    folder, index, rpm)), os.urandom(rpm_size))
+        write(join(chart, 'scripts', 'run.sh'), 'echo run\n')
+        write(join(chart, 'scripts', 'scriptEntries.txt'),
+              'run.sh:/opt/run.sh\n')
+    return inputs, names
+
+
+def make_integration(root, output_dir, names):
+    template = join(root, 'integration-template')
+    write(join(template, 'Chart.yaml'),
+          'apiVersion: v2\nname: eric-enm-sdk-integration-template\n'
+          'version: <<VERSION>>\n')
+    write(join(template, 'values.yaml'), 'global: {}\n')
+    archive = join(root, 'eric-enm-sdk-integration-template-0.0.0.tgz')
+    with tarfile.open(archive, 'w:gz') as _tar:
+        _tar.add(template, arcname='eric-enm-sdk-integration-template')
+    shutil.rmtree(template)
+
+    chart_yaml = join(root, 'integration', 'Chart.yaml')
+    dump_yaml(chart_yaml, {
+        'apiVersion': 'v2', 'name': 'eric-enm-sdk-bench', 'version': '1.0.0',
+        'dependencies': [{'name': _name, 'version': '1.0.{0}'.format(_i),
+                          'repository': 'file://{0}'.format(
+                              join(output_dir, _name))}
+                         for _i, _name in enumerate(names)]})
+    images = join(root, 'integration', 'images.txt')
+    write(images, AM_PACKAGE_MANAGER + '\n')
+    return chart_yaml, archive, images
+
+
+def make_docker_archive(root, count, layer_size):
+    directory = join(root, 'docker')
+    os.makedirs(directory)
+    images = ['armdocker.rnd.ericsson.se/proj-enm/bench{0}:1.{0}'.format(_i)
+              for _i in range(count)]
+    manifest = []
+    with tarfile.open(join(directory, 'docker.tar'), 'w') as _tar:
+        def add(name, data):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            _tar.addfile(info, io.BytesIO(data))
+
+        for index, image in enumerate(images):
+            layer = '{0:064x}'.format(index + 1)
+            add(layer + '/layer.tar', os.urandom(layer_size))
+            add(layer + '/VERSION', b'1.0')
+            add(layer + '/json', b'{}')
+            config = '{0:064x}.json'.format(index + 1000)
+            add(config, json.dumps({'index': index}).encode())
+            manifest.append({'Config': config, 'RepoTags': [image],
+                             'Layers': [layer + '/layer.tar']})
+        add('manifest.json', json.dumps(manifest).encode())
+    write(join(directory, 'images.txt'), '\n'.join(images) + '\n')
+    return join(directory, 'images.txt')
+
+
+class Bench:
+
+    def __init__(self, args, scratch):
+        self.args = args
+        self.scratch = scratch
+        self.bin_dir = join(scratch, 'bin')
+        write_shims(self.bin_dir)
+        self.env = dict(os.environ)
+        self.env.update({
+            'PATH': self.bin_dir + os.pathsep + os.environ.get('PATH', ''),
+            'HOME': join(scratch, 'home'),
+            'SHIM_LATENCY': str(args.latency),
+            'SHIM_OUTPUT_LINES': str(args.output_lines),
+            'SHIM_STATE': join(scratch, 'docker-state.json')})
+        self.templates = make_templates(scratch, args.values_keys)
+        self.inputs, self.names = make_inputs(
+            scratch, args.charts, args.rpms, args.rpm_size, args.values_keys)
+        self.output = join(scratch, 'out')
+        self.integration = make_integration(scratch, self.output, self.names)
+        self.docker_images = make_docker_archive(
+            scratch, args.images, args.layer_size)
+
+    def tool(self, *args):
+        _start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, TOOL] + list(args), env=self.env,
+            cwd=self.scratch, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        _time = time.perf_counter() - _start
+        if process.returncode != 0:
+            sys.stdout.write(process.stdout.decode(errors='replace')[-4000:])
+            raise SystemExit('sdkBuildManager.py {0} failed'.format(
+                ' '.join(args)))
+        return _time
+
+    def reset(self):
+        for path in [self.output, self.env['HOME'], self.env['SHIM_STATE']]:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def generate_chart(self):
+        return self.tool('--build-load-images', '--sdk-path', self.templates,
+                         '--sdk-input-path', self.inputs,
+                         '--repository-url', 'registry.local/bench',
+                         '--custom-sdk-path', self.output, '-d',
+                         '--jobs', str(self.args.jobs), '--cache',
+                         '--template-cache')
+
+    def generate_chart_cold(self):
+        self.reset()
+        return self.generate_chart()
+
+    def generate_chart_warm(self):
+        if not os.path.isdir(self.output):
+            self.generate_chart()
+        return self.generate_chart()
+
+    def rebuild_csar(self, *extra):
+        if not os.path.isdir(self.output):
+            self.generate_chart()
+        chart_yaml, template, images = self.integration
+        return self.tool('--rebuild-csar', chart_yaml,
+                         '--custom-sdk-path', self.output,
+                         '--integ-sdk-path', template,
+                         '--product-set', '23.1',
+                         '--repository-url', 'registry.local/bench',
+                         '-i', images, *extra)
+
+    def rebuild_csar_native(self):
+        return self.rebuild_csar('--csar-light', '--csar-writer', 'native')
+
+    def load_csar_images(self):
+        self.reset()
+        return self.tool('--load-csar-images', '-i', self.docker_images,
+                         '--repository-url', 'registry.local/bench')
+
+    def yaml_merge(self):
+        engine = sdkBuildManager.YamlEngine()
+        _yaml = sdkBuildManager.Yaml()
+        template = values_document(TEMPLATE_CHART, self.args.values_keys)
+        text = engine.dump(template, None)
+        _start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name in self.names:
+                data = engine.load(io.StringIO(text))
+                with open(join(self.inputs, name, 'config',
+                               'values.yaml')) as _reader:
+                    _yaml.merge(data, engine.load(_reader))
+                engine.dump(data, io.StringIO())
+        return time.perf_counter() - _start
+
+
+BENCHMARKS = ['generate_chart_cold', 'generate_chart_warm', 'rebuild_csar',
+              'rebuild_csar_native', 'load_csar_images', 'yaml_merge']
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        ratio = result['median'] / previous['median']
+        result['baseline'] = previous['median']
+        result['ratio'] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append('{0}: {1:.3f}s vs {2:.3f}s ({3:+.0%})'.format(
+                name, result['median'], previous['median'], ratio - 1))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Offline sdkBuildManager benchmark')
+    parser.add_argument('--charts', type=int, default=4)
+    parser.add_argument('--rpms', type=int, default=3,
+                        help='RPMs per jboss, models and uninstall folder')
+    parser.add_argument('--rpm-size', type=int, default=1024 * 1024)
+    parser.add_argument('--values-keys', type=int, default=2000,
+                        help='size of the generated values files')
+    parser.add_argument('--images', type=int, default=8,
+                        help='images in the generated docker archive')
+    parser.add_argument('--layer-size', type=int, default=2 * 1024 * 1024)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds every docker/helm call takes')
+    parser.add_argument('--output-lines', type=int, default=20,
+                        help='lines every docker/helm call prints')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append', choices=BENCHMARKS)
+    parser.add_argument('--out', default='bench_sdk_build.json')
+    parser.add_argument('--baseline',
+                        help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown against the baseline '
+                             '(default: %(default)s)')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the scratch directory')
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='sdk-bench-')
+    try:
+        bench = Bench(args, scratch)
+        results = {}
+        for name in args.only or BENCHMARKS:
+            runs = [getattr(bench, name)() for _ in range(args.repeat)]
+            results[name] = {'median': statistics.median(runs),
+                             'min': min(runs), 'runs': runs}
+            print('{0:<22} median {1:8.3f}s  min {2:8.3f}s'.format(
+                name, results[name]['median'], results[name]['min']))
+    finally:
+        if args.keep:
+            print('Scratch directory: {0}'.format(scratch))
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as _reader:
+            regressions = compare(results, json.load(_reader), args.threshold)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {_k: _v for _k, _v in vars(args).items()
+                       if _k not in ('out', 'baseline', 'keep')},
+        'results': results,
+        'regressions': regressions,
+    }
+    with open(args.out, 'w') as _writer:
+        json.dump(report, _writer, indent=2)
+    print('Results written to {0}'.format(args.out))
+
+    for regression in regressions:
+        print('REGRESSION {0}'.format(regression))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
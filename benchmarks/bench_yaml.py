@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the sdkBuildManager YAML engine, comparing the libyaml
+(CSafeLoader/CSafeDumper) path with the pure-Python fallback.
+
+By default the YAML files shipped in fmsdk_bm_csar_source are used. Extra
+files or directories, e.g. an extracted fm-sdk-templates chart, can be
+given as arguments.
+
+    python benchmarks/bench_yaml.py [--repeat N] [PATH ...]
+"""
+import argparse
+import glob
+import io
+import sys
+import time
+from os.path import abspath, dirname, isdir, join
+
+ROOT = abspath(join(dirname(__file__), '..'))
+sys.path.insert(0, join(ROOT, 'src'))
+
+from sdkBuildManager import YamlEngine  # noqa: E402
+
+
+def yaml_files(paths):
+    files = []
+    for path in paths:
+        if isdir(path):
+            files.extend(sorted(glob.glob(join(path, '**', '*.yaml'),
+                                          recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def bench(engine, documents, repeat):
+    _start = time.perf_counter()
+    for _ in range(repeat):
+        for text in documents.values():
+            engine.load(io.StringIO(text))
+    load = time.perf_counter() - _start
+
+    data = [engine.load(io.StringIO(text)) for text in documents.values()]
+    _start = time.perf_counter()
+    for _ in range(repeat):
+        for document in data:
+            engine.dump(document, io.StringIO())
+    dump = time.perf_counter() - _start
+    return load, dump
+
+
+def main():
+    parser = argparse.ArgumentParser(description='YAML engine benchmark')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('paths', nargs='*',
+                        default=[join(ROOT, 'fmsdk_bm_csar_source')])
+    args = parser.parse_args()
+
+    documents = {}
+    for path in yaml_files(args.paths):
+        with open(path) as _reader:
+            documents[path] = _reader.read()
+    size = sum(len(text) for text in documents.values())
+    print('{0} files, {1} bytes, {2} iterations'.format(
+        len(documents), size, args.repeat))
+
+    engines = [('pure', YamlEngine(pure=True))]
+    accelerated = YamlEngine()
+    if accelerated.accelerated:
+        engines.append(('libyaml', accelerated))
+    else:
+        print('libyaml is not available, only the pure-Python path is run')
+
+    results = {}
+    for name, engine in engines:
+        results[name] = bench(engine, documents, args.repeat)
+        print('{0:<8} load {1:8.3f}s  dump {2:8.3f}s'.format(
+            name, *results[name]))
+
+    if 'libyaml' in results:
+        pure, fast = results['pure'], results['libyaml']
+        print('speedup  load {0:7.1f}x  dump {1:7.1f}x'.format(
+            pure[0] / fast[0], pure[1] / fast[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,48 @@
 #!/usr/bin/env python
+import asyncio
+import contextlib
+import copy
 import datetime
-import fileinput
+import fnmatch
+import functools
 import glob
+import itertools
+import gzip
+import hashlib
+import io
 import json
-import math
 import os
+import posixpath
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 
+if sys.version_info < (3, 8):
+    raise SystemExit('Python 3.8 or later is required, commands are run '
+                     'with asyncio from worker threads')
+
 try:
     import yaml as pyyaml
 except ImportError:
     raise SystemExit('Module "pyyaml" not installed in python environment!'
                      '\nRun: pip install PyYAML')
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 import argparse
 import re
 import shutil
+import struct
 import tarfile
-from collections import OrderedDict
+import zipfile
+import zlib
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from os import listdir, rename
 from os.path import isdir, dirname, join, basename, exists, splitext, \
     abspath, expandvars, expanduser
@@ -27,12 +50,45 @@ from typing import List, Any, Tuple, Optional, Dict
 import uuid
 
 VERBOSE = False
+COMMAND_LOG_DIR = None
+
+_LOG_LOCK = threading.Lock()
+_LOG_CONTEXT = threading.local()
+
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+
+class CommandError(SystemError):
+    """
+    A command exited with a non-zero status. args[0] is the status, as for
+    the plain SystemError raised before, and tail holds the last lines the
+    command printed.
+    """
+
+    def __init__(self, command: List[str], returncode: int,
+                 tail: List[str]) -> None:
+        super().__init__(returncode)
+        self.command = command
+        self.returncode = returncode
+        self.tail = tail
+
+    def __str__(self) -> str:
+        message = '{0} exited with status {1}'.format(
+            ' '.join(self.command), self.returncode)
+        if self.tail:
+            message += ', last output:\n  ' + '\n  '.join(self.tail)
+        return message
 
 
 class Base:
     @staticmethod
     def _log(level, tag, message) -> None:
-        print('{0}: {1}: {2}'.format(level, tag, message))
+        prefix = getattr(_LOG_CONTEXT, 'prefix', None)
+        if prefix:
+            tag = '[{0}] {1}'.format(prefix, tag)
+        with _LOG_LOCK:
+            print('{0}: {1}: {2}'.format(level, tag, message))
 
     def info(self, tag: str, message: str) -> None:
         self._log('INFO', tag, message)
@@ -40,10 +96,55 @@ class Base:
     def warn(self, tag: str, message: str) -> None:
         self._log('WARN', tag, message)
 
+    def error(self, tag: str, message: str) -> None:
+        self._log('ERROR', tag, message)
+
     def debug(self, tag: str, message: str) -> None:
         if VERBOSE:
             self._log('DEBUG', tag, message)
 
+    @staticmethod
+    def get_log_prefix() -> Optional[str]:
+        return getattr(_LOG_CONTEXT, 'prefix', None)
+
+    @staticmethod
+    def with_log_prefix(prefix: Optional[str], func, *args, **kwargs):
+        """
+        Call func with every log line of the current thread prefixed with
+        prefix, so output from parallel workers can be told apart.
+        """
+        previous = getattr(_LOG_CONTEXT, 'prefix', None)
+        _LOG_CONTEXT.prefix = prefix
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _LOG_CONTEXT.prefix = previous
+
+    def result_summary(self, tag: str, title: str, results: Any) -> None:
+        """
+        Log one line with the status and duration of every ChartResult.
+        """
+        self.info(tag, title)
+        for result in results:
+            self.info(tag, '  {0:<48} {1:<8} {2:>9.1f}s'.format(
+                result.name, result.status, result.duration))
+
+    @staticmethod
+    def csar_templates() -> str:
+        """
+        Locate the CSAR manifest and vnfd templates, either in the
+        templates folder or in a fmsdk_bm_csar_source checkout.
+        """
+        templates = abspath(join(dirname(__file__), '..', 'templates', 'csar'))
+        if not isdir(templates):
+            _git = abspath(join(dirname(__file__),
+                                '..', 'fmsdk_bm_csar_source'))
+            if isdir(_git):
+                templates = _git
+            else:
+                raise FileNotFoundError(templates)
+        return templates
+
     @staticmethod
     def which(binary_file):
         try:
@@ -52,54 +153,407 @@ class Base:
         except SystemError:
             return False
 
-    def _execute(self, command: List[str], cwd=None, log=True) -> int:
-        _start = time.perf_counter()
-        process = subprocess.Popen(
-            command, cwd=cwd,
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        for line in iter(process.stdout.readline, b''):
-            if log:
-                self.info('PROCESS', line.decode().strip())
-        process.stdout.close()
-        process.wait()
-        _end = time.perf_counter()
+    def _execute(self, command: List[str], cwd=None, log=True,
+                 log_file: Optional[str] = None) -> float:
+        """
+        Run command, streaming its output to the log, and return how long
+        it took in seconds.
+
+        :param command: command and arguments
+        :param cwd: working directory of the command
+        :param log: log every output line, otherwise output is only kept
+            for the failure report
+        :param log_file: file the full output is also written to; defaults
+            to a new file in COMMAND_LOG_DIR when that is set
+        :raises CommandError: if the command exits with a non-zero status
+        """
+        return CommandRunner().run(command, cwd, log, log_file)
+
+    def _execute_many(self, commands: List[List[str]], cwd=None, log=True,
+                      limit: Optional[int] = None) -> List[float]:
+        """
+        Run commands concurrently from one event loop, at most limit at a
+        time, and return their durations. Every command is run; the first
+        failure is raised once all of them have finished.
+        """
+        return CommandRunner().run_many(commands, cwd, log, limit)
+
+    def _execute_output(self, command: List[str], cwd=None) -> str:
+        process = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
         if process.returncode != 0:
-            raise SystemError(process.returncode)
-        return math.ceil(_end - _start)
+            self.debug('PROCESS', process.stderr.decode().strip())
+            raise CommandError(command, process.returncode,
+                               process.stderr.decode().splitlines()[
+                                   -CommandRunner.TAIL_LINES:])
+        return process.stdout.decode()
+
+    @staticmethod
+    def format_size(size: Optional[int]) -> str:
+        if size is None:
+            return '-'
+        for unit in ['B', 'KiB', 'MiB', 'GiB']:
+            if size < 1024 or unit == 'GiB':
+                break
+            size /= 1024.0
+        return '{0:.1f}{1}'.format(size, unit)
+
+    @staticmethod
+    def write_file(file_path: str, data: str) -> None:
+        """
+        Replace the contents of file_path with data atomically, through a
+        temporary file in the same directory, keeping its permissions.
+        """
+        fd, _tmp = tempfile.mkstemp(dir=dirname(abspath(file_path)),
+                                    prefix='.{0}.'.format(basename(file_path)))
+        try:
+            with os.fdopen(fd, 'w', newline='') as _writer:
+                _writer.write(data)
+            if exists(file_path):
+                shutil.copymode(file_path, _tmp)
+            else:
+                os.chmod(_tmp, 0o666 & ~_UMASK)
+            os.replace(_tmp, file_path)
+        except BaseException:
+            if exists(_tmp):
+                os.remove(_tmp)
+            raise
+
+    def render_template(self, file_path: str, values: Dict[str, str],
+                        report: bool = True) -> List[str]:
+        """
+        Substitute every key of values found in file_path with its value,
+        reading and writing the file once. Returns the <<TOKEN>>
+        placeholders still left in the file, which are also logged when
+        report is set.
+        """
+        if not exists(file_path):
+            return []
+        with open(file_path, newline='') as _reader:
+            data = _reader.read()
+
+        if values:
+            tokens = sorted(values, key=len, reverse=True)
+            pattern = re.compile('|'.join(re.escape(_t) for _t in tokens))
+            rendered = pattern.sub(lambda _m: values[_m.group(0)], data)
+            if rendered != data:
+                self.write_file(file_path, rendered)
+                data = rendered
+
+        unresolved = sorted(set(re.findall(r'<<[A-Z0-9_]+>>', data)))
+        if unresolved and report:
+            self.warn('TEMPLATE', 'Unresolved placeholders in {0}: {1}'.format(
+                file_path, ', '.join(unresolved)))
+        return unresolved
+
+    @staticmethod
+    def copy_file(src: str, dst: str) -> None:
+        """
+        shutil.copy2 that never writes through an existing dst, which may
+        be linked to a template file.
+        """
+        if isdir(dst):
+            dst = join(dst, basename(src))
+        if os.path.lexists(dst):
+            os.remove(dst)
+        shutil.copy2(src, dst)
 
     @staticmethod
     def replace_value(file_path: str, chart_name: str, string_to_replace: str):
-        if exists(file_path):
-            with fileinput.FileInput(file_path, inplace=True) as _contents:
-                for line in _contents:
-                    print(line.replace(string_to_replace, chart_name), end='')
+        Base().render_template(file_path, {string_to_replace: chart_name},
+                               report=False)
 
     @staticmethod
     def get_command_flags(command, *options) -> Optional[str]:
         sdk_cfg = expandvars(expanduser('~/.cenm_sdk/config.yaml'))
         if exists(sdk_cfg):
             _yaml = Yaml()
-            _cfg = _yaml.load(sdk_cfg)
+            _cfg = _yaml.load_cached(sdk_cfg)
             return _yaml.get_flags(_cfg, command, *options)
         return None
 
+    @staticmethod
+    def get_command_options(command, *options) -> Dict:
+        sdk_cfg = expandvars(expanduser('~/.cenm_sdk/config.yaml'))
+        if exists(sdk_cfg):
+            _yaml = Yaml()
+            return _yaml.get_options(_yaml.load_cached(sdk_cfg) or {},
+                                     command, *options)
+        return {}
+
+
+class CommandRunner(Base):
+    """
+    Runs commands with asyncio. Output is read in chunks, split into lines
+    for the log, optionally copied verbatim to a log file and the last
+    TAIL_LINES lines are kept for the CommandError raised on failure.
+    """
+    CHUNK_SIZE = 64 * 1024
+    TAIL_LINES = 40
+    _SEQUENCE = itertools.count(1)
+
+    def __init__(self, tail_lines: int = TAIL_LINES) -> None:
+        super().__init__()
+        self._tail_lines = tail_lines
+
+    def _log_file(self, command: List[str]) -> Optional[str]:
+        if not COMMAND_LOG_DIR:
+            return None
+        os.makedirs(COMMAND_LOG_DIR, exist_ok=True)
+        name = '-'.join(re.sub(r'[^\w.]+', '_', basename(_arg))
+                        for _arg in command[:3] if not _arg.startswith('-'))
+        return join(COMMAND_LOG_DIR, '{0:04d}-{1}.log'.format(
+            next(self._SEQUENCE), name[:64]))
+
+    async def _run(self, command: List[str], cwd, log: bool,
+                   log_file: Optional[str]) -> float:
+        tail = deque(maxlen=self._tail_lines)
+        log_file = log_file or self._log_file(command)
+        _writer = open(log_file, 'wb') if log_file else None
+        _start = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, cwd=cwd, stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT)
+            pending = b''
+            while True:
+                chunk = await process.stdout.read(self.CHUNK_SIZE)
+                if _writer and chunk:
+                    _writer.write(chunk)
+                if chunk:
+                    lines = (pending + chunk).split(b'\n')
+                    pending = lines.pop()
+                else:
+                    lines = [pending] if pending else []
+                for line in lines:
+                    text = line.decode(errors='replace').strip()
+                    tail.append(text)
+                    if log:
+                        self.info('PROCESS', text)
+                if not chunk:
+                    break
+            await process.wait()
+        finally:
+            if _writer:
+                _writer.close()
+        _time = time.perf_counter() - _start
+        if process.returncode != 0:
+            if not log:
+                # quiet commands are often probes expected to fail, the
+                # tail is still part of the CommandError
+                for text in tail:
+                    self.debug('PROCESS', text)
+            raise CommandError(command, process.returncode, list(tail))
+        return _time
+
+    # asyncio.run runs the event loop in the calling thread, so log lines
+    # keep that thread's log prefix. Running it from worker threads needs
+    # the threaded child watcher that is the default since Python 3.8.
+    def run(self, command: List[str], cwd=None, log: bool = True,
+            log_file: Optional[str] = None) -> float:
+        return asyncio.run(self._run(command, cwd, log, log_file))
+
+    def run_many(self, commands: List[List[str]], cwd=None, log: bool = True,
+                 limit: Optional[int] = None) -> List[float]:
+        async def _gather():
+            semaphore = asyncio.Semaphore(limit or len(commands) or 1)
+
+            async def _bounded(command):
+                async with semaphore:
+                    return await self._run(command, cwd, log, None)
+            return await asyncio.gather(
+                *[_bounded(_command) for _command in commands],
+                return_exceptions=True)
+
+        results = asyncio.run(_gather())
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+
+class Tracer(Base):
+    """
+    Records spans of a run as Chrome trace events, which Perfetto and
+    chrome://tracing can display. Nothing is recorded until enable() is
+    called. Spans nest per thread; annotate() adds attributes such as the
+    chart, image tag, bytes or cache hits to the innermost open span.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._events = []
+        self._threads = {}
+        self._path = None
+        self._origin = time.perf_counter()
+
+    def enable(self, path: str) -> None:
+        self._path = path
+        self._origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **attributes):
+        if not self._path:
+            yield attributes
+            return
+        stack = self._local.__dict__.setdefault('stack', [])
+        prefix = self.get_log_prefix()
+        if prefix and 'chart' not in attributes:
+            attributes['chart'] = prefix
+        stack.append(attributes)
+        _start = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as error:
+            attributes['error'] = repr(error)
+            raise
+        finally:
+            _end = time.perf_counter()
+            stack.pop()
+            thread = threading.current_thread()
+            with self._lock:
+                self._threads[thread.ident] = thread.name
+                self._events.append({
+                    'name': name, 'cat': category, 'ph': 'X',
+                    'ts': round((_start - self._origin) * 1e6, 1),
+                    'dur': round((_end - _start) * 1e6, 1),
+                    'pid': os.getpid(), 'tid': thread.ident,
+                    'args': attributes})
+
+    def traced(self, name: str, category: str):
+        """
+        Decorator recording every call of the decorated function as a span.
+        """
+        def _decorator(func):
+            @functools.wraps(func)
+            def _wrapper(*args, **kwargs):
+                with self.span(name, category):
+                    return func(*args, **kwargs)
+            return _wrapper
+        return _decorator
+
+    def annotate(self, **attributes) -> None:
+        stack = getattr(self._local, 'stack', None)
+        if stack:
+            stack[-1].update(attributes)
+
+    def save(self) -> None:
+        if not self._path:
+            return
+        with self._lock:
+            events = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                       'tid': _tid, 'args': {'name': _name}}
+                      for _tid, _name in self._threads.items()]
+            events.extend(sorted(self._events, key=lambda _e: _e['ts']))
+        self.write_file(self._path, json.dumps(
+            {'traceEvents': events, 'displayTimeUnit': 'ms'}, default=str))
+        self.info('TRACE', 'Wrote {0} spans to {1}'.format(
+            len(events) - len(self._threads), self._path))
+
+
+TRACER = Tracer()
+
 
 class Tar(Base):
+    CACHE_SIZE = 8
+    _ROOT_FILE = '.root'
 
-    def extract_tar(self, tar_file: str, overwrite: bool) -> str:
-        templates_dir = dirname(tar_file)
-        _tgz = tarfile.open(tar_file)
-        _root = _tgz.getnames()[0]
+    def __init__(self, cache_dir: Optional[str] = None,
+                 cache_size: int = CACHE_SIZE) -> None:
+        """
+        :param cache_dir: If set, archives are extracted once into
+         <cache_dir>/<sha256 of archive> and reused from there
+        :param cache_size: Number of extracted archives kept in cache_dir,
+         least recently used ones are removed first
+        """
+        super().__init__()
+        self._cache_dir = cache_dir
+        self._cache_size = cache_size
 
-        destination = join(templates_dir, _root)
-        if isdir(destination) and not overwrite:
-            raise Exception('Can\'t extract {0} as directory {1} '
-                            'already exists'.format(tar_file, destination))
+    def _stream_extract(self, tar_file: str, directory: str,
+                        overwrite: bool = True) -> str:
+        """
+        Extract tar_file into directory reading the archive once, and return
+        the name of its top level entry. Members without a named component,
+        such as the "./" entry of archives created with "tar -C dir .", are
+        skipped when looking for it.
+        """
+        _root = None
+        with tarfile.open(tar_file, 'r|*') as _tgz:
+            for member in _tgz:
+                _parts = [_part for _part in member.name.split('/')
+                          if _part not in ['', '.']]
+                if _root is None and _parts:
+                    _root = _parts[0]
+                    destination = join(directory, _root)
+                    if isdir(destination) and not overwrite:
+                        raise Exception('Can\'t extract {0} as directory {1} '
+                                        'already exists'.format(tar_file,
+                                                                destination))
+                _tgz.extract(member, directory)
+        if _root is None:
+            raise ValueError('{0} has no named top level entry'.format(
+                tar_file))
+        return _root
+
+    @TRACER.traced('extract templates', 'tar')
+    def extract_tar(self, tar_file: str, overwrite: bool) -> str:
+        TRACER.annotate(archive=basename(tar_file),
+                        bytes=os.path.getsize(tar_file))
+        if self._cache_dir:
+            return self._extract_cached(tar_file)
 
+        templates_dir = dirname(tar_file)
         self.info('TAR', 'Extracting {0} to {1}'.format(
             tar_file, templates_dir))
-        _tgz.extractall(templates_dir)
-        return destination
+        return join(templates_dir, self._stream_extract(
+            tar_file, templates_dir, overwrite))
+
+    def _extract_cached(self, tar_file: str) -> str:
+        cache_dir = abspath(expanduser(self._cache_dir))
+        os.makedirs(cache_dir, exist_ok=True)
+        entry = join(cache_dir, Digests().file_digest(tar_file))
+        root_file = join(entry, self._ROOT_FILE)
+
+        if exists(root_file):
+            with open(root_file) as _reader:
+                _root = _reader.read().strip()
+            os.utime(entry)
+            TRACER.annotate(cache_hit=True)
+            self.info('TAR', 'Using cached extraction of {0} in {1}'.format(
+                tar_file, entry))
+            return join(entry, _root)
+
+        TRACER.annotate(cache_hit=False)
+        self.info('TAR', 'Extracting {0} to {1}'.format(tar_file, entry))
+        _tmp = tempfile.mkdtemp(prefix='.extract-', dir=cache_dir)
+        try:
+            os.chmod(_tmp, 0o777 & ~_UMASK)
+            _root = self._stream_extract(tar_file, _tmp)
+            with open(join(_tmp, self._ROOT_FILE), 'w') as _writer:
+                _writer.write(_root)
+            try:
+                os.rename(_tmp, entry)
+            except OSError:
+                # Extracted by another process in the meantime
+                shutil.rmtree(_tmp)
+        except BaseException:
+            shutil.rmtree(_tmp, ignore_errors=True)
+            raise
+        self._evict(cache_dir, entry)
+        return join(entry, _root)
+
+    def _evict(self, cache_dir: str, keep: str) -> None:
+        entries = [join(cache_dir, _e) for _e in listdir(cache_dir)
+                   if not _e.startswith('.')]
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for entry in entries[self._cache_size:]:
+            if entry != keep:
+                self.info('TAR', 'Removing {0} from the extraction '
+                                 'cache'.format(entry))
+                shutil.rmtree(entry, ignore_errors=True)
 
 
 class Sed:
@@ -109,13 +563,116 @@ class Sed:
                       r'\g<1>{0}'.format(value), data)
 
 
-class Yaml(Base):
+class Dockerfile:
+    @staticmethod
+    def args(data: str) -> Dict[str, str]:
+        _args = {}
+        for match in re.finditer(r'^\s*ARG\s+(\w+)(?:=(\S*))?', data,
+                                 re.MULTILINE | re.IGNORECASE):
+            _args[match.group(1)] = match.group(2) or ''
+        return _args
 
-    def __init__(self) -> None:
-        super().__init__()
+    @staticmethod
+    def from_images(data: str) -> List[str]:
+        _args = Dockerfile.args(data)
 
-    def load(self, file_path: str) -> OrderedDict:
-        class OrderedLoader(pyyaml.SafeLoader):
+        def _expand(match):
+            return _args.get(match.group(1) or match.group(2), '')
+
+        images = []
+        for match in re.finditer(r'^\s*FROM\s+(?:--\S+\s+)*(\S+)', data,
+                                 re.MULTILINE | re.IGNORECASE):
+            images.append(re.sub(r'\$\{(\w+)\}|\$(\w+)', _expand,
+                                 match.group(1)))
+        return images
+
+    @staticmethod
+    def instructions(data: str) -> List[Tuple[str, str]]:
+        """
+        (INSTRUCTION, arguments) pairs of data, with comments dropped and
+        continuation lines joined.
+        """
+        _instructions = []
+        current = ''
+        for line in data.splitlines():
+            stripped = line.strip()
+            if not current and (not stripped or stripped.startswith('#')):
+                continue
+            if current and stripped.startswith('#'):
+                continue
+            if stripped.endswith('\\'):
+                current += stripped[:-1] + ' '
+                continue
+            current += stripped
+            if current:
+                parts = current.split(None, 1)
+                _instructions.append((parts[0].upper(),
+                                      parts[1] if len(parts) > 1 else ''))
+            current = ''
+        if current.strip():
+            parts = current.split(None, 1)
+            _instructions.append((parts[0].upper(),
+                                  parts[1] if len(parts) > 1 else ''))
+        return _instructions
+
+    @staticmethod
+    def context_sources(data: str) -> Optional[List[str]]:
+        """
+        The build context paths or patterns the COPY and ADD instructions
+        of data read, or None if that cannot be told for certain (parser
+        directives, heredocs, variables, bind mounts, ...).
+        """
+        if re.match(r'\s*#\s*(escape|syntax)\s*=', data, re.IGNORECASE):
+            return None
+        sources = []
+        for instruction, arguments in Dockerfile.instructions(data):
+            if instruction == 'RUN' and re.search(
+                    r'--mount=\S*type=bind', arguments) and \
+                    'from=' not in arguments:
+                return None
+            if instruction not in ('COPY', 'ADD'):
+                continue
+            if '<<' in arguments or '$' in arguments:
+                return None
+            words = arguments.split()
+            flags = [_w for _w in words if _w.startswith('--')]
+            if any(_f.startswith('--from') for _f in flags):
+                continue
+            if any(_f.split('=')[0] not in ('--chown', '--chmod', '--link')
+                   for _f in flags):
+                return None
+            words = words[len(flags):]
+            if words and words[0].startswith('['):
+                try:
+                    words = json.loads(' '.join(words))
+                except ValueError:
+                    return None
+            if len(words) < 2:
+                return None
+            for source in words[:-1]:
+                if instruction == 'ADD' and re.match(r'\w+://', source):
+                    continue
+                sources.append(source)
+        return sources
+
+
+class YamlEngine:
+    """
+    OrderedDict preserving loader and dumper classes, built once per
+    process. Uses the libyaml backed CSafeLoader/CSafeDumper when PyYAML was
+    built with them and falls back to the pure-Python SafeLoader/SafeDumper
+    otherwise (or when pure is set). None is dumped as an empty value.
+    """
+
+    def __init__(self, pure: bool = False) -> None:
+        base_loader = pyyaml.SafeLoader
+        base_dumper = pyyaml.SafeDumper
+        if not pure:
+            base_loader = getattr(pyyaml, 'CSafeLoader', base_loader)
+            base_dumper = getattr(pyyaml, 'CSafeDumper', base_dumper)
+        self.accelerated = base_loader is not pyyaml.SafeLoader
+
+        class OrderedLoader(base_loader):
             pass
 
         def construct_mapping(loader, node):
@@ -125,12 +682,8 @@ class Yaml(Base):
         OrderedLoader.add_constructor(
             pyyaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
             construct_mapping)
-        self.debug('YAML', 'Loading {0}'.format(file_path))
-        with open(file_path, 'r') as stream:
-            return pyyaml.load(stream, OrderedLoader)
 
-    def dump(self, data: OrderedDict, file_path: str, **kwds) -> None:
-        class OrderedDumper(pyyaml.SafeDumper):
+        class OrderedDumper(base_dumper):
             pass
 
         def _dict_representer(dumper, yaml_data):
@@ -146,16 +699,90 @@ class Yaml(Base):
         OrderedDumper.add_representer(OrderedDict, _dict_representer)
         OrderedDumper.add_representer(type(None), _none_representer)
 
+        self.loader = OrderedLoader
+        self.dumper = OrderedDumper
+
+    def load(self, stream: Any) -> Any:
+        return pyyaml.load(stream, self.loader)
+
+    def dump(self, data: Any, stream: Any, **kwds) -> Any:
+        return pyyaml.dump(data, stream, self.dumper,
+                           default_flow_style=False, **kwds)
+
+
+YAML_ENGINE = YamlEngine()
+
+
+class DocumentCache(Base):
+    """
+    Parsed YAML documents keyed by path, mtime and size, for files such as
+    build.yaml and ~/.cenm_sdk/config.yaml that are read many times per
+    run. Every caller gets its own deep copy of the document.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self._documents = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, file_path: str) -> Any:
+        path = abspath(file_path)
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._documents.get(path)
+            if entry and entry[0] == key:
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+
+        self.debug('YAML', 'Loading {0}'.format(file_path))
+        with open(path, 'r') as stream:
+            data = YAML_ENGINE.load(stream)
+        with self._lock:
+            self.misses += 1
+            self._documents[path] = (key, data)
+        return copy.deepcopy(data)
+
+    def invalidate(self, file_path: str) -> None:
+        with self._lock:
+            self._documents.pop(abspath(file_path), None)
+
+    def report(self) -> None:
+        self.info('YAML', 'Document cache: {0} hits, {1} misses'.format(
+            self.hits, self.misses))
+
+
+DOCUMENT_CACHE = DocumentCache()
+
+
+class Yaml(Base):
+
+    def __init__(self) -> None:
+        super().__init__()
+
+    def load(self, file_path: str) -> OrderedDict:
+        self.debug('YAML', 'Loading {0}'.format(file_path))
+        with open(file_path, 'r') as stream:
+            return YAML_ENGINE.load(stream)
+
+    @staticmethod
+    def load_cached(file_path: str) -> Any:
+        return DOCUMENT_CACHE.load(file_path)
+
+    def dump(self, data: OrderedDict, file_path: str, **kwds) -> None:
         self.debug('YAML', 'Writing {0}'.format(file_path))
-        with open(file_path, 'w') as stream:
-            pyyaml.dump(data, stream, OrderedDumper,
-                        default_flow_style=False, **kwds)
+        DOCUMENT_CACHE.invalidate(file_path)
+        stream = io.StringIO()
+        YAML_ENGINE.dump(data, stream, **kwds)
+        self.write_file(file_path, stream.getvalue())
 
     def get_build_options(self, sdk_input_path: str,
                           chart_name: str) -> OrderedDict:
         _opts_path = join(sdk_input_path, chart_name, 'config', 'build.yaml')
         self.debug('YAML', 'Loading build options from {0}'.format(_opts_path))
-        return self.load(_opts_path)
+        return self.load_cached(_opts_path)
 
     def merge(self, base: Any, changes: Any) -> None:
         if isinstance(changes, list):
@@ -175,6 +802,12 @@ class Yaml(Base):
             return self.__traverse(_flags, keys[1:])
         return _flags
 
+    def get_options(self, config: Dict, command: str, *args) -> Dict:
+        _options = config.get(command)
+        if _options and args:
+            _options = self.__traverse(_options, args)
+        return _options or {}
+
     def get_flags(self, config: Dict, command: str, *args) -> Optional[str]:
         _flags = config.get(command)
         if _flags:
@@ -191,16 +824,1051 @@ class Yaml(Base):
         return None
 
 
-class Chart(Base):
+class Digests(Base):
+    """
+    SHA-256 digests of files and directory trees. File digests are memoized
+    by path, size and mtime so unchanged files are only hashed once.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def file_digest(self, path: str) -> str:
+        path = abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            memo = self._files.get(path)
+        if memo and memo[0] == stat.st_size and memo[1] == stat.st_mtime_ns:
+            return memo[2]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as _reader:
+            for block in iter(lambda: _reader.read(1024 * 1024), b''):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with self._lock:
+            self._files[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def tree_digest(self, *paths: str) -> str:
+        sha = hashlib.sha256()
+        for path in paths:
+            sha.update(b'\0path\0')
+            if isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for _file in sorted(files):
+                        _abs = join(root, _file)
+                        sha.update(os.path.relpath(_abs, path).encode())
+                        sha.update(self.file_digest(_abs).encode())
+            elif exists(path):
+                sha.update(self.file_digest(path).encode())
+            else:
+                sha.update(b'missing')
+        return sha.hexdigest()
+
+    @staticmethod
+    def fingerprint(*parts: str) -> str:
+        return hashlib.sha256('\0'.join(parts).encode()).hexdigest()
+
+
+class StageCache(Digests):
+    """
+    Fingerprints of the inputs of every custom chart build stage, stored
+    in <output_dir>/.sdk-build-cache.json. A stage whose fingerprint is
+    unchanged since its last successful run can be skipped.
+
+    The file digest memo is stored alongside so unchanged RPMs are not
+    hashed again on every run.
+    """
+    FILE_NAME = '.sdk-build-cache.json'
+    VERSION = 1
+
+    def __init__(self, output_dir: str) -> None:
+        super().__init__()
+        self._path = join(output_dir, self.FILE_NAME)
+        self._stages = {}
+        if exists(self._path):
+            try:
+                with open(self._path) as _reader:
+                    data = json.load(_reader)
+                if data.get('version') == self.VERSION:
+                    self._files = data['files']
+                    self._stages = data['stages']
+            except ValueError:
+                self.warn('CACHE', 'Ignoring corrupt {0}'.format(self._path))
+
+    def is_fresh(self, chart_name: str, stage: str, fingerprint: str) -> bool:
+        with self._lock:
+            stages = self._stages.get(chart_name, {})
+            return stages.get(stage) == fingerprint
+
+    def update(self, chart_name: str, stage: str, fingerprint: str) -> None:
+        with self._lock:
+            self._stages.setdefault(chart_name, {})[stage] = fingerprint
+        self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            _tmp = '{0}.{1}.tmp'.format(self._path, threading.get_ident())
+            with open(_tmp, 'w') as _writer:
+                json.dump({'version': self.VERSION, 'files': self._files,
+                           'stages': self._stages},
+                          _writer, indent=1, sort_keys=True)
+            os.replace(_tmp, self._path)
+
+
+class HelmCache(Digests):
+    """
+    Results of helm dependency update and helm lint, keyed by the chart
+    content and resolved flags, stored in ~/.cenm_sdk/cache/helm.json.
+    The file is shared by concurrent builds: every write re-reads it under
+    a lock, keeps the MAX_ENTRIES most recently stored entries and
+    atomically replaces it.
+    """
+    FILE_NAME = '~/.cenm_sdk/cache/helm.json'
+    VERSION = 2
+    MAX_ENTRIES = 512
+
+    def __init__(self, path: str = FILE_NAME) -> None:
+        super().__init__()
+        self._path = abspath(expanduser(path))
+        self._entries = self._read()
+
+    def _read(self) -> Dict[str, Dict]:
+        if not exists(self._path):
+            return {}
+        try:
+            with open(self._path) as _reader:
+                data = json.load(_reader)
+        except ValueError:
+            self.warn('CACHE', 'Ignoring corrupt {0}'.format(self._path))
+            return {}
+        return data['entries'] if data.get('version') == self.VERSION else {}
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        os.makedirs(dirname(self._path), exist_ok=True)
+        with open(self._path + '.lock', 'w') as _lock:
+            if fcntl:
+                fcntl.flock(_lock, fcntl.LOCK_EX)
+            yield
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key: str, value: Dict) -> None:
+        value = dict(value, stored=time.time())
+        with self._lock, self._file_lock():
+            entries = self._read()
+            entries[key] = value
+            if len(entries) > self.MAX_ENTRIES:
+                entries = dict(sorted(
+                    entries.items(), key=lambda _e: _e[1].get('stored', 0)
+                )[-self.MAX_ENTRIES:])
+            self._entries = entries
+            _fd, _tmp = tempfile.mkstemp(prefix='.helm.json.',
+                                         dir=dirname(self._path))
+            try:
+                with os.fdopen(_fd, 'w') as _writer:
+                    json.dump({'version': self.VERSION, 'entries': entries},
+                              _writer, indent=1, sort_keys=True)
+                os.replace(_tmp, self._path)
+            except BaseException:
+                os.remove(_tmp)
+                raise
+
+
+class Staging(Base):
+    """
+    Copies template trees into generated charts. In link mode files are
+    reflinked (copy-on-write clones) or hard linked instead of copied,
+    falling back to a plain copy across filesystems. Files the tool
+    rewrites are replaced through Base.write_file or Base.copy_file, which
+    break the link instead of writing through it.
+    """
+    MODES = ['copy', 'link']
+    # Files written in place by helm
+    PRIVATE = ['Chart.lock']
+    _FICLONE = 0x40049409
+
+    def __init__(self, mode: str = 'copy') -> None:
+        super().__init__()
+        if mode not in self.MODES:
+            raise ValueError('Unknown staging mode {0}'.format(mode))
+        self.mode = mode
+        self._reflink = fcntl is not None
+        self._hardlink = True
+
+    def _clone(self, src: str, dst: str) -> bool:
+        with open(src, 'rb') as _src, open(dst, 'wb') as _dst:
+            try:
+                fcntl.ioctl(_dst.fileno(), self._FICLONE, _src.fileno())
+                return True
+            except OSError:
+                self._reflink = False
+        os.remove(dst)
+        return False
+
+    def stage_file(self, src: str, dst: str) -> str:
+        if self.mode == 'link' and basename(src) not in self.PRIVATE:
+            if self._reflink and self._clone(src, dst):
+                shutil.copystat(src, dst)
+                return dst
+            if self._hardlink:
+                try:
+                    os.link(src, dst)
+                    return dst
+                except OSError:
+                    self._hardlink = False
+        return shutil.copy2(src, dst)
+
+    def copytree(self, src: str, dst: str) -> str:
+        self.debug('STAGING', '{0} {1} to {2}'.format(
+            'Linking' if self.mode == 'link' else 'Copying', src, dst))
+        staged = []
+
+        def _stage(_src, _dst):
+            staged.append(os.path.getsize(_src))
+            return self.stage_file(_src, _dst)
+
+        with TRACER.span('stage templates', 'chart', mode=self.mode) as span:
+            result = shutil.copytree(src, dst, symlinks=True,
+                                     copy_function=_stage)
+            span.update(files=len(staged), bytes=sum(staged))
+        return result
+
+
+class BlobStore(Digests):
+    """
+    Content-addressed store of staged files, <output_dir>/.sdk-blobs/<sha256>.
+    Each distinct RPM is copied into the store once and then hard linked
+    into every image context or scripts folder that needs it. Targets
+    already holding the same content are left alone. Nothing writes
+    through a staged file: targets are always unlinked before being
+    replaced. Blobs no target links to any more are removed by prune.
+    """
+    DIR_NAME = '.sdk-blobs'
+
+    def __init__(self, output_dir: str) -> None:
+        super().__init__()
+        self.root = join(abspath(output_dir), self.DIR_NAME)
+        self._hardlink = True
+
+    @staticmethod
+    def _fast_copy(src: str, dst: str) -> None:
+        """
+        Copy src to dst in the kernel, with copy_file_range where available
+        (which can also share extents) and sendfile through shutil otherwise.
+        """
+        if hasattr(os, 'copy_file_range'):
+            try:
+                with open(src, 'rb') as _src, open(dst, 'wb') as _dst:
+                    size = os.fstat(_src.fileno()).st_size
+                    while size > 0:
+                        copied = os.copy_file_range(
+                            _src.fileno(), _dst.fileno(), size)
+                        if copied == 0:
+                            break
+                        size -= copied
+                    if size == 0:
+                        shutil.copystat(src, dst)
+                        return
+            except OSError:
+                pass
+        shutil.copyfile(src, dst)
+        shutil.copystat(src, dst)
+
+    def _unchanged(self, src_stat, dst: str, digest: Optional[str]) -> bool:
+        try:
+            dst_stat = os.stat(dst)
+        except FileNotFoundError:
+            return False
+        if os.path.samestat(src_stat, dst_stat):
+            return True
+        if dst_stat.st_size != src_stat.st_size:
+            return False
+        if digest is None:
+            return dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+        return self.file_digest(dst) == digest
+
+    def _blob(self, src: str, digest: str) -> str:
+        blob = join(self.root, digest)
+        if not exists(blob):
+            os.makedirs(self.root, exist_ok=True)
+            _fd, _tmp = tempfile.mkstemp(prefix='.blob-', dir=self.root)
+            os.close(_fd)
+            try:
+                self._fast_copy(src, _tmp)
+                os.replace(_tmp, blob)
+            except BaseException:
+                os.remove(_tmp)
+                raise
+        return blob
+
+    def stage(self, src: str, dst: str) -> str:
+        """
+        Make dst a copy of src.
+
+        :param src: source file
+        :param dst: target file
+        :return: 'unchanged' if dst already had the content of src, else
+            'linked' or 'copied'
+        """
+        src_stat = os.stat(src)
+        if self._unchanged(src_stat, dst, None):
+            return 'unchanged'
+        digest = self.file_digest(src)
+        if self._unchanged(src_stat, dst, digest):
+            return 'unchanged'
+
+        blob = self._blob(src, digest)
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if self._hardlink:
+            try:
+                os.link(blob, dst)
+                return 'linked'
+            except OSError:
+                self._hardlink = False
+        self._fast_copy(blob, dst)
+        return 'copied'
+
+    def stage_all(self, files: List[str], target_dir: str,
+                  tag: str = 'DOCKER') -> None:
+        """
+        Stage files into target_dir and log what was linked, copied or
+        skipped.
+        """
+        counts = OrderedDict((_r, 0) for _r in ['linked', 'copied',
+                                                 'unchanged'])
+        size = 0
+        for src in files:
+            result = self.stage(src, join(target_dir, basename(src)))
+            self.debug(tag, '{0} {1} in {2}'.format(
+                result.capitalize(), basename(src), target_dir))
+            counts[result] += 1
+            size += os.path.getsize(src)
+        TRACER.annotate(bytes=size, **counts)
+        self.info(tag, 'Staged {0} files ({1}) into {2}: {3}'.format(
+            len(files), self.format_size(size), target_dir,
+            ', '.join('{0} {1}'.format(_n, _r) for _r, _n in counts.items()
+                      if _n)))
+
+    def prune(self) -> None:
+        """
+        Remove the blobs no staged file links to any more, that is those with
+        a link count of 1. Without hard links every blob is removed, as each
+        target already holds its own copy.
+        """
+        if not isdir(self.root):
+            return
+        count, size = 0, 0
+        for name in listdir(self.root):
+            if name.startswith('.'):
+                continue
+            blob = join(self.root, name)
+            try:
+                blob_stat = os.stat(blob)
+                if blob_stat.st_nlink == 1:
+                    os.remove(blob)
+                    count += 1
+                    size += blob_stat.st_size
+            except FileNotFoundError:
+                pass
+        if count:
+            self.info('BLOBS', 'Removed {0} unreferenced blobs ({1}) from '
+                               '{2}'.format(count, self.format_size(size),
+                                            self.root))
+
+
+class BuildContext(Base):
+    """
+    Minimal docker build contexts: only the files the COPY and ADD
+    instructions of a Dockerfile read are hard linked into a separate
+    directory, so the daemon is not sent the rest of the chart.
+    """
+    MODES = ['minimal', 'full']
+
+    @staticmethod
+    def _size(path: str) -> int:
+        if not isdir(path):
+            return os.path.getsize(path)
+        size = 0
+        for root, _, files in os.walk(path):
+            size += sum(os.lstat(join(root, _file)).st_size
+                        for _file in files)
+        return size
+
+    @staticmethod
+    def _match(context: str, pattern: str) -> List[str]:
+        """
+        Paths relative to context matching pattern, segment by segment and
+        including dot files, as docker matches COPY sources.
+        """
+        pattern = posixpath.normpath(pattern.lstrip('/'))
+        if pattern in ('.', ''):
+            return ['.']
+        matches = ['']
+        for segment in pattern.split('/'):
+            found = []
+            for match in matches:
+                _dir = join(context, match)
+                if not glob.has_magic(segment):
+                    if os.path.lexists(join(_dir, segment)):
+                        found.append(posixpath.join(match, segment))
+                elif isdir(_dir):
+                    found.extend(posixpath.join(match, _name)
+                                 for _name in sorted(listdir(_dir))
+                                 if fnmatch.fnmatchcase(_name, segment))
+            matches = found
+        return matches
+
+    @staticmethod
+    def _link(src: str, dst: str) -> None:
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    def prepare(self, dockerfile: str, context: str, minimal: str) -> str:
+        """
+        Create the minimal context of dockerfile in the directory minimal
+        and return it, or return context itself if the files the
+        Dockerfile needs cannot be determined.
+        """
+        with open(dockerfile) as _reader:
+            sources = Dockerfile.context_sources(_reader.read())
+        if sources is None:
+            self.info('DOCKER', 'Cannot tell which files {0} uses, sending '
+                                'the full build context'.format(dockerfile))
+            return context
+
+        paths = set()
+        for source in sources:
+            matches = self._match(context, source)
+            if not matches:
+                self.info('DOCKER', '{0} matches nothing in {1}, sending the '
+                                    'full build context'.format(source,
+                                                                context))
+                return context
+            if '.' in matches:
+                return context
+            paths.update(matches)
+        if exists(join(context, '.dockerignore')):
+            paths.add('.dockerignore')
+
+        if os.path.lexists(minimal):
+            shutil.rmtree(minimal)
+        os.makedirs(minimal)
+        for path in sorted(paths):
+            src, dst = join(context, path), join(minimal, path)
+            os.makedirs(dirname(dst), exist_ok=True)
+            if isdir(src) and not os.path.islink(src):
+                if not exists(dst):
+                    shutil.copytree(src, dst, symlinks=True,
+                                    copy_function=self._link)
+            elif not os.path.lexists(dst):
+                if os.path.islink(src):
+                    os.symlink(os.readlink(src), dst)
+                else:
+                    self._link(src, dst)
+
+        before, after = self._size(context), self._size(minimal)
+        TRACER.annotate(context_bytes=after, full_context_bytes=before)
+        self.info('DOCKER', 'Build context of {0}: {1} instead of {2} '
+                            '({3} paths)'.format(
+                                basename(dockerfile), self.format_size(after),
+                                self.format_size(before), len(paths)))
+        return minimal
+
+
+class ChartWorkspace(Base):
+    """
+    In-memory copy of the documents of one custom chart. Each document is
+    parsed on first use, every rename, override and merge is applied to
+    the parsed data, and flush writes each changed file exactly once.
+    """
 
     def __init__(self) -> None:
+        super().__init__()
         self._yaml = Yaml()
+        self._documents = {}
+        self._texts = {}
+        self._dirty = []
+
+    def load(self, file_path: str) -> Any:
+        path = abspath(file_path)
+        if path not in self._documents:
+            self._documents[path] = self._yaml.load(path)
+        return self._documents[path]
+
+    def changed(self, file_path: str) -> None:
+        path = abspath(file_path)
+        self._texts.pop(path, None)
+        if path not in self._dirty:
+            self._dirty.append(path)
+
+    def write_text(self, file_path: str, text: str) -> None:
+        path = abspath(file_path)
+        self.changed(path)
+        self._documents.pop(path, None)
+        self._texts[path] = text
+
+    def flush(self) -> None:
+        for path in self._dirty:
+            if path in self._texts:
+                self.write_file(path, self._texts[path])
+            else:
+                self._yaml.dump(self._documents[path], path)
+        self.debug('CHART', 'Wrote {0} chart documents'.format(
+            len(self._dirty)))
+        self._dirty = []
+
+
+class HelmIgnore:
+    """
+    Rules of a chart .helmignore file, evaluated the way helm does: a
+    pattern without a slash matches the file name only, one with a slash
+    matches the path from the chart root, a trailing slash only matches
+    directories and a leading ! negates the rule.
+    """
+    DEFAULTS = ['templates/.?*']
+
+    def __init__(self, lines: List[str]) -> None:
+        self._rules = []
+        for line in self.DEFAULTS + lines:
+            rule = line.strip()
+            if not rule or rule.startswith('#'):
+                continue
+            negate = rule.startswith('!')
+            rule = rule[1:] if negate else rule
+            must_dir = len(rule) > 1 and rule.endswith('/')
+            rule = rule.rstrip('/') if must_dir else rule
+            structural = '/' in rule
+            self._rules.append((re.compile(self._translate(
+                rule.lstrip('/'))), negate, must_dir, structural))
+
+    @staticmethod
+    def load(chart_dir: str) -> 'HelmIgnore':
+        ignore_file = join(chart_dir, '.helmignore')
+        if not exists(ignore_file):
+            return HelmIgnore([])
+        with open(ignore_file) as _reader:
+            return HelmIgnore(_reader.read().splitlines())
+
+    @staticmethod
+    def _translate(pattern: str) -> str:
+        # filepath.Match semantics: wildcards never cross a separator
+        regex, index = '', 0
+        while index < len(pattern):
+            char = pattern[index]
+            index += 1
+            if char == '*':
+                regex += '[^/]*'
+            elif char == '?':
+                regex += '[^/]'
+            elif char == '[':
+                end = pattern.find(']', index + 1)
+                if end < 0:
+                    regex += re.escape(char)
+                    continue
+                body = pattern[index:end].replace('\\', '\\\\')
+                regex += '[' + body + ']'
+                index = end + 1
+            elif char == '\\' and index < len(pattern):
+                regex += re.escape(pattern[index])
+                index += 1
+            else:
+                regex += re.escape(char)
+        return regex + r'\Z'
+
+    def ignored(self, rel_path: str, is_dir: bool) -> bool:
+        for regex, negate, must_dir, structural in self._rules:
+            name = rel_path if structural else posixpath.basename(rel_path)
+            if negate:
+                if must_dir and not is_dir:
+                    return True
+                if not regex.match(name):
+                    return True
+                continue
+            if must_dir and not is_dir:
+                continue
+            if regex.match(name):
+                return True
+        return False
+
+
+class ChartPackager(Base):
+    """
+    In-process replacement for helm package. Writes <name>-<version>.tgz
+    with the files helm would include, in a fixed order and with fixed
+    ownership, helm's 0644 permissions and fixed timestamps, so the same
+    chart directory always gives a byte-identical archive. Chart.yaml is
+    checked as helm package checks it.
+    """
+    PACKAGERS = ['helm', 'native']
+    COMPRESS_LEVEL = 6
+    API_VERSIONS = ['v1', 'v2']
+    # helm accepts partial versions like 1.2 and a leading v
+    SEMVER = re.compile(r'^v?\d+(\.\d+){0,2}(-[0-9A-Za-z.-]+)?'
+                        r'(\+[0-9A-Za-z.-]+)?$')
+
+    def __init__(self, compress_level: int = COMPRESS_LEVEL) -> None:
+        super().__init__()
+        self._level = compress_level
+        self._mtime = int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+
+    def _files(self, chart_dir: str) -> List[str]:
+        ignore = HelmIgnore.load(chart_dir)
+        files = []
+        for root, dirs, names in os.walk(chart_dir, followlinks=True):
+            rel_root = os.path.relpath(root, chart_dir).replace(os.sep, '/')
+            rel_root = '' if rel_root == '.' else rel_root + '/'
+            dirs[:] = [_dir for _dir in dirs
+                       if not ignore.ignored(rel_root + _dir, True)]
+            files.extend(rel_root + _name for _name in names
+                         if not ignore.ignored(rel_root + _name, False))
+        # Chart.yaml first, as helm does, then everything in path order
+        return sorted(files, key=lambda _path: (_path != 'Chart.yaml', _path))
+
+    def validate(self, chart_dir: str) -> Dict[str, Any]:
+        """
+        Check Chart.yaml of chart_dir the way helm package does.
+
+        :return: the Chart.yaml document
+        """
+        chart_yaml = join(chart_dir, 'Chart.yaml')
+        chart_data = Yaml().load(chart_yaml)
+        if not isinstance(chart_data, dict):
+            raise ValueError('{0}: not a valid chart definition'.format(
+                chart_yaml))
+        if not chart_data.get('apiVersion'):
+            raise ValueError('{0}: apiVersion is required'.format(
+                chart_yaml))
+        if chart_data['apiVersion'] not in self.API_VERSIONS:
+            raise ValueError('{0}: apiVersion {1!r} is not valid'.format(
+                chart_yaml, chart_data['apiVersion']))
+        if not chart_data.get('name'):
+            raise ValueError('{0}: name is required'.format(chart_yaml))
+        if not chart_data.get('version'):
+            raise ValueError('{0}: version is required'.format(chart_yaml))
+        if not self.SEMVER.match(str(chart_data['version'])):
+            raise ValueError('{0}: version {1!r} is not a valid '
+                             'SemVer'.format(chart_yaml,
+                                             chart_data['version']))
+        if chart_data.get('type', 'application') not in \
+                ['application', 'library']:
+            raise ValueError('{0}: type {1!r} is not valid'.format(
+                chart_yaml, chart_data['type']))
+        return chart_data
+
+    def _tar_info(self, name: str, path: str) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(name)
+        info.size = os.stat(path).st_size
+        info.mtime = self._mtime
+        # helm package writes every file as 0644
+        info.mode = 0o644
+        info.uid = info.gid = 0
+        info.uname = info.gname = ''
+        return info
+
+    def package(self, chart_dir: str, output_dir: str) -> str:
+        """
+        Package chart_dir into output_dir.
+
+        :param chart_dir: chart directory containing Chart.yaml
+        :param output_dir: directory the archive is written to
+        :return: path of the written archive
+        """
+        chart_data = self.validate(chart_dir)
+        chart_name = chart_data['name']
+        chart_file = join(output_dir, '{0}-{1}.tgz'.format(
+            chart_name, chart_data['version']))
+
+        _fd, _tmp = tempfile.mkstemp(prefix='.' + basename(chart_file),
+                                     dir=output_dir)
+        try:
+            with os.fdopen(_fd, 'wb') as _raw, \
+                    gzip.GzipFile(filename='', mode='wb', fileobj=_raw,
+                                  compresslevel=self._level,
+                                  mtime=self._mtime) as _gz, \
+                    tarfile.open(fileobj=_gz, mode='w',
+                                 format=tarfile.PAX_FORMAT) as _tar:
+                for rel_path in self._files(chart_dir):
+                    path = join(chart_dir, rel_path)
+                    with open(path, 'rb') as _reader:
+                        _tar.addfile(self._tar_info(
+                            chart_name + '/' + rel_path, path), _reader)
+            os.chmod(_tmp, 0o666 & ~_UMASK)
+            os.replace(_tmp, chart_file)
+        except BaseException:
+            os.remove(_tmp)
+            raise
+        return chart_file
+
+
+CsarMember = namedtuple('CsarMember',
+                        'name method crc size sha256 data mode')
+
+
+class CsarWriter(Base):
+    """
+    In-process replacement for the package manager's generate --helm3
+    --no-images. Writes a TOSCA-Metadata CSAR from a staged build
+    directory:
+
+        TOSCA-Metadata/TOSCA.meta
+        <manifest>.mf
+        Definitions/<vnfd>.yaml
+        Definitions/<etsi types>.yaml
+        Definitions/OtherTemplates/<chart>.tgz
+        Scripts/...
+
+    Members are compressed in parallel. Chart archives and other
+    already-compressed files are stored as they are.
+    """
+    WRITERS = ['package-manager', 'native']
+    COMPRESS_LEVEL = 6
+    CHUNK_SIZE = 1024 * 1024
+    SPOOL_SIZE = 16 * 1024 * 1024
+    STORED_SUFFIXES = ('.tgz', '.gz', '.tar', '.zip', '.csar', '.rpm',
+                       '.jar', '.xz', '.bz2', '.zst')
+    TOSCA_META = 'TOSCA-Metadata/TOSCA.meta'
+    ZIP_LIMIT = 0xFFFFFFFF
+
+    def __init__(self, jobs: int = 0,
+                 compress_level: int = COMPRESS_LEVEL) -> None:
+        super().__init__()
+        self._jobs = jobs or os.cpu_count() or 1
+        self._level = compress_level
+        # DOS timestamps start in 1980
+        _mtime = time.gmtime(max(int(os.environ.get('SOURCE_DATE_EPOCH', 0)),
+                                 315532800))
+        self._dos_time = (_mtime.tm_hour << 11) | (_mtime.tm_min << 5) | \
+                         (_mtime.tm_sec // 2)
+        self._dos_date = ((_mtime.tm_year - 1980) << 9) | \
+                         (_mtime.tm_mon << 5) | _mtime.tm_mday
+
+    def layout(self, build_dir: str, vnfd: str, manifest: str,
+               scripts: Optional[str] = None) -> List[Tuple[str, Any]]:
+        """
+        Map the staged files of build_dir to their CSAR member names.
+
+        :return: (member name, file path or bytes) in archive order
+        """
+        definitions = join(self.csar_templates(), 'definitions')
+        members = [
+            (self.TOSCA_META, '\n'.join([
+                'TOSCA-Meta-File-Version: 1.0',
+                'CSAR-Version: 1.1',
+                'Created-By: Ericsson',
+                'Entry-Definitions: Definitions/{0}'.format(basename(vnfd)),
+                'Entry-Manifest: {0}'.format(basename(manifest)),
+                '']).encode()),
+            (basename(manifest), manifest),
+            ('Definitions/{0}'.format(basename(vnfd)), vnfd)]
+        members.extend(
+            ('Definitions/{0}'.format(_file), join(definitions, _file))
+            for _file in sorted(listdir(definitions)))
+        charts = join(build_dir, 'charts')
+        members.extend(
+            ('Definitions/OtherTemplates/{0}'.format(_file),
+             join(charts, _file))
+            for _file in sorted(listdir(charts)) if _file.endswith('.tgz'))
+        if scripts and isdir(scripts):
+            members.extend(
+                ('Scripts/{0}'.format(_file), join(scripts, _file))
+                for _file in sorted(listdir(scripts))
+                if not isdir(join(scripts, _file)))
+        return members
+
+    def _member(self, name: str, source: Any) -> CsarMember:
+        if isinstance(source, bytes):
+            reader, mode = io.BytesIO(source), 0o644
+        else:
+            reader = open(source, 'rb')
+            mode = 0o755 if os.access(source, os.X_OK) else 0o644
+        stored = name.endswith(self.STORED_SUFFIXES)
+        crc, size, sha256 = 0, 0, hashlib.sha256()
+        data = None if stored else tempfile.SpooledTemporaryFile(
+            self.SPOOL_SIZE)
+        compressor = None if stored else zlib.compressobj(
+            self._level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        with reader:
+            for chunk in iter(lambda: reader.read(self.CHUNK_SIZE), b''):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                sha256.update(chunk)
+                if compressor:
+                    data.write(compressor.compress(chunk))
+        if stored:
+            # stream the source itself into the archive later
+            data = source if isinstance(source, str) else io.BytesIO(source)
+            return CsarMember(name, zipfile.ZIP_STORED, crc, size,
+                              sha256.hexdigest(), data, mode)
+        data.write(compressor.flush())
+        data.seek(0)
+        return CsarMember(name, zipfile.ZIP_DEFLATED, crc, size,
+                          sha256.hexdigest(), data, mode)
+
+    def write(self, csar_file: str, members: List[Tuple[str, Any]]) -> str:
+        """
+        Write members, as returned by layout(), to csar_file, and its
+        index next to it.
+
+        :return: csar_file
+        """
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            prepared = list(executor.map(lambda _m: self._member(*_m),
+                                         members))
+
+        _fd, _tmp = tempfile.mkstemp(prefix='.' + basename(csar_file),
+                                     dir=dirname(abspath(csar_file)))
+        central = []
+        try:
+            with os.fdopen(_fd, 'wb') as _out:
+                for member in prepared:
+                    offset = _out.tell()
+                    name = member.name.encode()
+                    _out.write(b'\0' * (30 + len(name)))
+                    if isinstance(member.data, str):
+                        with open(member.data, 'rb') as _reader:
+                            shutil.copyfileobj(_reader, _out, self.CHUNK_SIZE)
+                    else:
+                        with member.data:
+                            shutil.copyfileobj(member.data, _out,
+                                               self.CHUNK_SIZE)
+                    end = _out.tell()
+                    csize = end - offset - 30 - len(name)
+                    if max(end, member.size) > self.ZIP_LIMIT:
+                        raise ValueError(
+                            '{0} needs ZIP64, which the native CSAR writer '
+                            'does not support'.format(member.name))
+                    header = struct.pack(
+                        '<HHHHHIIIHH', 20, 0, member.method, self._dos_time,
+                        self._dos_date, member.crc, csize, member.size,
+                        len(name), 0)
+                    _out.seek(offset)
+                    _out.write(struct.pack('<I', 0x04034b50) + header + name)
+                    _out.seek(end)
+                    central.append(struct.pack(
+                        '<IH', 0x02014b50, (3 << 8) | 20) + header +
+                        struct.pack('<HHHII', 0, 0, 0,
+                                    (0o100000 | member.mode) << 16, offset) +
+                        name)
+                cd_offset = _out.tell()
+                for record in central:
+                    _out.write(record)
+                _out.write(struct.pack(
+                    '<IHHHHIIH', 0x06054b50, 0, 0, len(central),
+                    len(central), _out.tell() - cd_offset, cd_offset, 0))
+            os.chmod(_tmp, 0o666 & ~_UMASK)
+            os.replace(_tmp, csar_file)
+        except BaseException:
+            os.remove(_tmp)
+            raise
+        finally:
+            for member in prepared:
+                if not isinstance(member.data, str):
+                    member.data.close()
+        self.info('CSAR', 'Wrote {0} members to {1} ({2})'.format(
+            len(prepared), csar_file,
+            self.format_size(os.stat(csar_file).st_size)))
+        CsarIndex(self._jobs).save(csar_file, OrderedDict(
+            (_m.name, OrderedDict([('size', _m.size),
+                                   ('sha256', _m.sha256)]))
+            for _m in prepared))
+        return csar_file
+
+    @classmethod
+    def verify(cls, csar_file: str) -> List[zipfile.ZipInfo]:
+        """
+        Check the zip central directory of csar_file: every member must lie
+        within the file and, when TOSCA.meta is present, the entries it
+        names must exist. The member data itself is not read.
+
+        :return: the members of the CSAR
+        """
+        with zipfile.ZipFile(csar_file) as _zip:
+            members = _zip.infolist()
+            names = set(_zip.namelist())
+            meta = _zip.read(cls.TOSCA_META).decode() \
+                if cls.TOSCA_META in names else ''
+        if not members:
+            raise zipfile.BadZipFile('{0} is empty'.format(csar_file))
+        _size = os.stat(csar_file).st_size
+        for member in members:
+            if member.header_offset + 30 + len(member.filename) + \
+                    member.compress_size > _size:
+                raise zipfile.BadZipFile('{0}: {1} is truncated'.format(
+                    csar_file, member.filename))
+        for line in meta.splitlines():
+            key, _, value = line.partition(':')
+            if key.strip().startswith('Entry-') and \
+                    value.strip() not in names:
+                raise zipfile.BadZipFile('{0}: {1} {2} not found'.format(
+                    csar_file, key.strip(), value.strip()))
+        return members
+
+
+class CsarIndex(Base):
+    """
+    The size and sha256 of every member of a CSAR, kept in a sidecar
+    <csar>.index.json. Members are hashed in parallel straight from the
+    archive, without extracting them to disk.
+    """
+    SUFFIX = '.index.json'
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, jobs: int = 0) -> None:
+        super().__init__()
+        self._jobs = jobs or os.cpu_count() or 1
+
+    def _hash_member(self, _zip: zipfile.ZipFile,
+                     info: zipfile.ZipInfo) -> Dict[str, Any]:
+        sha256, size = hashlib.sha256(), 0
+        with _zip.open(info) as _reader:
+            for chunk in iter(lambda: _reader.read(self.CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                size += len(chunk)
+        return OrderedDict([('size', size), ('sha256', sha256.hexdigest())])
+
+    def build(self, csar_file: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Hash every member of csar_file. The central directory is read once
+        and every worker thread opens the archive once, as ZipFile objects
+        can't be shared between threads.
+
+        :return: member name -> size and sha256, in archive order
+        """
+        with zipfile.ZipFile(csar_file) as _zip:
+            members = [_info for _info in _zip.infolist()
+                       if not _info.is_dir()]
+        local = threading.local()
+        opened = []
+        lock = threading.Lock()
+
+        def _hash(info):
+            _zip = getattr(local, 'zip', None)
+            if _zip is None:
+                _zip = local.zip = zipfile.ZipFile(csar_file)
+                with lock:
+                    opened.append(_zip)
+            return self._hash_member(_zip, info)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+                entries = list(executor.map(_hash, members))
+        finally:
+            for _zip in opened:
+                _zip.close()
+        return OrderedDict((_info.filename, _entry)
+                           for _info, _entry in zip(members, entries))
+
+    def save(self, csar_file: str,
+             entries: Optional[Dict[str, Dict[str, Any]]] = None) -> str:
+        """
+        Write the index of csar_file, hashing its members unless entries
+        are given.
+
+        :return: path of the index
+        """
+        if entries is None:
+            with TRACER.span('index csar', 'csar'):
+                entries = self.build(csar_file)
+        _stat = os.stat(csar_file)
+        index_file = csar_file + self.SUFFIX
+        self.write_file(index_file, json.dumps(OrderedDict([
+            ('csar', basename(csar_file)), ('size', _stat.st_size),
+            ('mtime_ns', _stat.st_mtime_ns), ('entries', entries)]),
+            indent=2))
+        self.info('CSAR', 'Indexed {0} members of {1} in {2}'.format(
+            len(entries), basename(csar_file), index_file))
+        return index_file
+
+    def load(self, path: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Read the entries of an index, or of a CSAR. A CSAR's sidecar index
+        is used while it still matches the CSAR's size and mtime,
+        otherwise the CSAR is hashed.
+        """
+        if path.endswith('.json'):
+            with open(path) as _reader:
+                return json.load(_reader,
+                                 object_pairs_hook=OrderedDict)['entries']
+        index_file = path + self.SUFFIX
+        if exists(index_file):
+            with open(index_file) as _reader:
+                index = json.load(_reader, object_pairs_hook=OrderedDict)
+            _stat = os.stat(path)
+            if (index.get('size'), index.get('mtime_ns')) == \
+                    (_stat.st_size, _stat.st_mtime_ns):
+                return index['entries']
+            self.warn('CSAR', '{0} is out of date, hashing {1}'.format(
+                index_file, path))
+        with TRACER.span('index csar', 'csar'):
+            return self.build(path)
+
+    def diff(self, path_a: str, path_b: str) -> int:
+        """
+        Log the members added, removed or changed between two CSARs or
+        indexes.
+
+        :return: the number of differences
+        """
+        entries_a, entries_b = self.load(path_a), self.load(path_b)
+        differences = 0
+        for name in entries_a:
+            if name not in entries_b:
+                differences += 1
+                self.info('DIFF', '- {0} ({1})'.format(
+                    name, self.format_size(entries_a[name]['size'])))
+            elif entries_a[name]['sha256'] != entries_b[name]['sha256']:
+                differences += 1
+                self.info('DIFF', '~ {0} ({1} -> {2})'.format(
+                    name, self.format_size(entries_a[name]['size']),
+                    self.format_size(entries_b[name]['size'])))
+        for name in entries_b:
+            if name not in entries_a:
+                differences += 1
+                self.info('DIFF', '+ {0} ({1})'.format(
+                    name, self.format_size(entries_b[name]['size'])))
+        self.info('DIFF', '{0} of {1} members differ between {2} and '
+                          '{3}'.format(differences,
+                                       len(set(entries_a) | set(entries_b)),
+                                       path_a, path_b))
+        return differences
+
+
+class Chart(Base):
+    EXACT_VERSION = re.compile(r'^v?\d+\.\d+\.\d+([-+][0-9A-Za-z.+-]*)?$')
+
+    def __init__(self, staging: Optional[Staging] = None,
+                 helm_cache: Optional[HelmCache] = None,
+                 packager: Optional[ChartPackager] = None) -> None:
+        self._yaml = Yaml()
+        self._staging = staging or Staging()
+        self._helm_cache = helm_cache
+        self._packager = packager
 
     def generate_custom_chart(self,
                               templates_dir: str, chart_name: str,
                               sdk_input_path: str, output_dir: str,
                               overwrite: bool,
-                              repository: str) -> Tuple[str, str]:
+                              repository: str,
+                              workspace: Optional[ChartWorkspace] = None
+                              ) -> Tuple[str, str]:
+        """
+        Copy the templates to a custom chart named chart_name and apply the
+        build options to its Chart.yaml and values.yaml. The documents are
+        changed in workspace, and written straight away if none is given.
+        """
+        flush = workspace is None
+        workspace = workspace or ChartWorkspace()
         if output_dir:
             custom_dir = join(output_dir, chart_name)
         else:
@@ -221,7 +1889,7 @@ class Chart(Base):
         image_opts = build_opts[chart_name]
         sdk_type = basename(sdk_input_path).lower()[0:2]
 
-        shutil.copytree(templates_dir, custom_dir)
+        self._staging.copytree(templates_dir, custom_dir)
 
         _chart = join(custom_dir, 'chart')
         inter_name = listdir(_chart)[0]
@@ -235,7 +1903,7 @@ class Chart(Base):
         chart_yaml = join(new_inter_dir, 'Chart.yaml')
         values_yaml = join(new_inter_dir, 'values.yaml')
 
-        chart_data = self._yaml.load(chart_yaml)
+        chart_data = workspace.load(chart_yaml)
 
         desc = image_opts.get('chart-description') if image_opts.get(
             'chart-description') else 'Helm chart for {0}'.format(chart_name)
@@ -250,10 +1918,9 @@ class Chart(Base):
         chart_data['version'] = chart_version
         self.info('CHART', 'Chart description: {0}'.format(desc))
         chart_data['description'] = desc
+        workspace.changed(chart_yaml)
 
-        self._yaml.dump(chart_data, chart_yaml)
-
-        values_data = self._yaml.load(values_yaml)
+        values_data = workspace.load(values_yaml)
 
         del values_data['images'][inter_name]
         values_data['images'][chart_name] = {
@@ -302,7 +1969,7 @@ class Chart(Base):
             self.info('CHART', 'No {0} build options set, '
                                'leaving as {1}'.format(k_monitoring, _tag))
 
-        self._yaml.dump(values_data, values_yaml)
+        workspace.changed(values_yaml)
         foldername = f'{chart_name}-models-{sdk_type}'
         torename='/'.join([custom_dir,foldername])
         existingfolder = f'eric-enm-custom-models-{sdk_type}-oneflow'
@@ -318,28 +1985,58 @@ class Chart(Base):
                     'eric-enmsg-custom-pm-oneflow']
 
         for template in tplates:
-            for _type in _t_types:
-                Base().replace_value(template, service_name,
-                                     _type)
+            self.render_template(
+                template, dict((_type, service_name) for _type in _t_types))
 
+        if flush:
+            workspace.flush()
         return custom_dir, chart_version
 
+    def stage_image_context(self, templates_dir: str, custom_dir: str,
+                            chart_name: str, sdk_input_path: str) -> None:
+        """
+        Replace the Dockerfiles and image content folders of an already
+        generated custom chart with fresh copies from the templates, leaving
+        the generated chart folder as is.
+        """
+        sdk_type = basename(sdk_input_path).lower()[0:2]
+        models_template = f'eric-enm-custom-models-{sdk_type}-oneflow'
+        self.info('CHART', 'Restaging image content of {0} from {1}'.format(
+            custom_dir, templates_dir))
+        for entry in listdir(templates_dir):
+            if entry == 'chart':
+                continue
+            target = entry
+            if entry == models_template:
+                target = f'{chart_name}-models-{sdk_type}'
+            source = join(templates_dir, entry)
+            target = join(custom_dir, target)
+            if isdir(target):
+                shutil.rmtree(target)
+            elif exists(target):
+                os.remove(target)
+            if isdir(source):
+                self._staging.copytree(source, target)
+            else:
+                self._staging.stage_file(source, target)
+
     def _merge_values_yaml(self, chart_path: str, chart_name: str,
-                           sdk_input_path: str):
+                           sdk_input_path: str, workspace: ChartWorkspace):
         values_yaml = join(chart_path, 'chart', chart_name, 'values.yaml')
         values_inputs = join(sdk_input_path, chart_name, 'config',
                              'values.yaml')
 
         self.info('CHART', 'Merging {0} into {1}'.format(
             values_inputs, values_yaml))
-        data = self._yaml.load(values_yaml)
+        data = workspace.load(values_yaml)
         merge = self._yaml.load(values_inputs)
 
         self._yaml.merge(data, merge)
-        self._yaml.dump(data, values_yaml)
+        workspace.changed(values_yaml)
 
     def _merge_global_properties(self, chart_path: str, chart_name: str,
-                                 sdk_input_path: str) -> None:
+                                 sdk_input_path: str,
+                                 workspace: ChartWorkspace) -> None:
 
         gp = join(sdk_input_path, chart_name, 'config',
                   'global-properties.json')
@@ -360,27 +2057,28 @@ class Chart(Base):
             for _key, _value in gp_data.items():
                 gp_data_str.append('{0}={1}\n'.format(_key, _value))
 
-            template_gp = self._yaml.load(template_gp_path)
+            template_gp = workspace.load(template_gp_path)
             if 'global.properties' in template_gp:
                 for kv_pair in template_gp['global.properties'].split('\n'):
                     gp_data_str.append('{0}\n'.format(kv_pair))
 
             gp_data_str = '  '.join(gp_data_str)
 
-            with open(template_gp_path, 'w') as _w:
-                _w.write('global.properties: |\n  ')
-                _w.write(''.join(gp_data_str))
+            workspace.write_text(template_gp_path,
+                                 'global.properties: |\n  ' +
+                                 ''.join(gp_data_str))
 
         p_volumes = join(appconfig, 'volumes.yaml')
-        volumes = self._yaml.load(p_volumes)
+        volumes = workspace.load(p_volumes)
         for volume in volumes:
             if volume['name'] == 'gp':
                 volume['configMap']['name'] = splitext(new_name)[0]
                 break
-        self._yaml.dump(volumes, p_volumes)
+        workspace.changed(p_volumes)
 
     def _merge_named_yaml(self, chart_path: str, chart_name: str,
-                          sdk_input_path: str) -> None:
+                          sdk_input_path: str,
+                          workspace: ChartWorkspace) -> None:
         """
         Merge any yaml files in {sdk_input_path}/sdk/<type>sdk/{chart_name}/config
          into the custom chart. The files in the config dir must be the same
@@ -388,6 +2086,7 @@ class Chart(Base):
         :param chart_path: PAth to the chart
         :param chart_name: The chart name
         :param sdk_input_path: Path to chart inputs
+        :param workspace: Workspace holding the chart documents
 
         """
         config = join(sdk_input_path, chart_name, 'config')
@@ -407,20 +2106,114 @@ class Chart(Base):
             if exists(c_yaml):
                 self.info('CHART', 'Merging {0} with {1}'.format(
                     m_yaml, c_yaml))
-                c_data = yaml.load(c_yaml)
+                c_data = workspace.load(c_yaml)
                 m_data = yaml.load(m_yaml)
 
                 yaml.merge(c_data, m_data)
-                yaml.dump(c_data, c_yaml)
+                workspace.changed(c_yaml)
             else:
                 self.info('CHART', 'Copying {0} to {1}'.format(m_yaml, c_yaml))
-                shutil.copy(m_yaml, c_yaml)
+                self.copy_file(m_yaml, c_yaml)
+
+    def merge_custom_chart_config(
+            self, chart_path: str, chart_name: str, sdk_input_path: str,
+            workspace: Optional[ChartWorkspace] = None) -> None:
+        flush = workspace is None
+        workspace = workspace or ChartWorkspace()
+        with TRACER.span('merge values.yaml', 'merge', chart=chart_name):
+            self._merge_values_yaml(chart_path, chart_name, sdk_input_path,
+                                    workspace)
+        with TRACER.span('merge global properties', 'merge',
+                         chart=chart_name):
+            self._merge_global_properties(chart_path, chart_name,
+                                          sdk_input_path, workspace)
+        with TRACER.span('merge named yaml', 'merge', chart=chart_name):
+            self._merge_named_yaml(chart_path, chart_name, sdk_input_path,
+                                   workspace)
+        if flush:
+            workspace.flush()
+
+    def get_chart_version(self, chart_name: str, sdk_input_path: str) -> str:
+        build_opts = self._yaml.get_build_options(sdk_input_path, chart_name)
+        return build_opts[chart_name].get('chart-version')
 
-    def merge_custom_chart_config(self, chart_path: str, chart_name: str,
-                                  sdk_input_path: str) -> None:
-        self._merge_values_yaml(chart_path, chart_name, sdk_input_path)
-        self._merge_global_properties(chart_path, chart_name, sdk_input_path)
-        self._merge_named_yaml(chart_path, chart_name, sdk_input_path)
+    def _dependency_key(self, a_chart: str,
+                        command: List[str]) -> Tuple[Optional[str], str]:
+        """
+        Cache key of helm dependency update for a_chart, made of the declared
+        dependencies (including the content of file:// ones) and the
+        command, and the current state of Chart.lock and charts/.
+        None, so the update always runs, if the chart has no dependencies
+        or a remote dependency isn't pinned to an exact version, as a new
+        upstream release could then match. The state is empty, and the
+        update always runs, while the chart has no lock file.
+        """
+        chart_data = self._yaml.load(join(a_chart, 'Chart.yaml')) or {}
+        dependencies = chart_data.get('dependencies') or []
+        if exists(join(a_chart, 'requirements.yaml')):
+            dependencies = dependencies + (self._yaml.load(
+                join(a_chart, 'requirements.yaml')) or {}).get(
+                'dependencies', [])
+        if not dependencies:
+            return None, ''
+        for dependency in dependencies:
+            if not str(dependency.get('repository', '')).startswith(
+                    'file://') and not self.EXACT_VERSION.match(
+                    str(dependency.get('version', ''))):
+                self.debug('CHART', 'Dependency {0} {1} is a version range, '
+                                    'not caching'.format(
+                                        dependency.get('name'),
+                                        dependency.get('version')))
+                return None, ''
+
+        parts = ['dependency', ' '.join(command),
+                 json.dumps(dependencies, sort_keys=True),
+                 self._helm_cache.tree_digest(
+                     join(a_chart, 'requirements.yaml'))]
+        for dependency in dependencies:
+            repository = str(dependency.get('repository', ''))
+            if repository.startswith('file://'):
+                parts.append(self._helm_cache.tree_digest(
+                    join(a_chart, repository[len('file://'):])))
+        state = ''
+        if exists(join(a_chart, 'Chart.lock')) or \
+                exists(join(a_chart, 'requirements.lock')):
+            state = self._helm_cache.tree_digest(
+                join(a_chart, 'Chart.lock'),
+                join(a_chart, 'requirements.lock'),
+                join(a_chart, 'charts'))
+        return self._helm_cache.fingerprint(*parts), state
+
+    def _lint_key(self, a_chart: str, command: List[str]) -> Tuple[str, str]:
+        flags = [_arg for _arg in command if _arg != a_chart]
+        return self._helm_cache.fingerprint(
+            'lint', ' '.join(flags),
+            self._helm_cache.tree_digest(a_chart)), 'linted'
+
+    def _helm_stage(self, a_chart: str, o_path: str, info: str,
+                    cmd: List[str], cache_key, native: bool):
+        key, state = None, None
+        if self._helm_cache and cache_key:
+            key, state = cache_key(a_chart, cmd)
+            entry = self._helm_cache.get(key) if key else None
+            if entry and state and entry.get('state') == state:
+                self.info('CHART', '{0}: cache hit, saved {1:.1f} '
+                                   'seconds'.format(info, entry['seconds']))
+                TRACER.annotate(cache_hit=True)
+                return
+        self.info('CHART', info)
+        _start = time.perf_counter()
+        if native:
+            self._packager.package(a_chart, o_path)
+            self.info('CHART', 'Native packaging took {0:.2f} '
+                               'seconds'.format(time.perf_counter() - _start))
+            return
+        self._execute(cmd)
+        _time = time.perf_counter() - _start
+        self.info('CHART', 'Helm took {0:.1f} seconds'.format(_time))
+        if key:
+            self._helm_cache.put(key, {
+                'state': cache_key(a_chart, cmd)[1], 'seconds': _time})
 
     def package(self, chart_path: str, chart_name: Optional[str] = None,
                 sdk_input_path: Optional[str] = None) -> str:
@@ -456,22 +2249,28 @@ class Chart(Base):
         _flags = self.get_command_flags('helm', 'package')
         if _flags:
             h_pkg.insert(4, _flags)
+        native = self._packager is not None
+        if native and _flags:
+            self.info('CHART', 'helm package flags are configured, '
+                               'packaging {0} with helm'.format(chart_name))
+            native = False
 
         cmds = (
-            ('Updating {0} chart dependencies'.format(chart_name),
-             h_dep_up),
-            ('Linting {0} chart'.format(chart_name),
-             h_lint),
-            ('Packaging chart {0} to {1}'.format(chart_name, o_path),
-             h_pkg)
+            ('dependency update',
+             'Updating {0} chart dependencies'.format(chart_name),
+             h_dep_up, self._dependency_key),
+            ('lint', 'Linting {0} chart'.format(chart_name),
+             h_lint, self._lint_key),
+            ('package',
+             'Packaging chart {0} to {1}'.format(chart_name, o_path),
+             h_pkg, None)
         )
 
-        for helm_cmd in cmds:
-            info = helm_cmd[0]
-            cmd = helm_cmd[1]
-            self.info('CHART', info)
-            _time = self._execute(cmd)
-            self.info('CHART', 'Helm took {0} seconds'.format(_time))
+        for stage, info, cmd, cache_key in cmds:
+            with TRACER.span('helm ' + stage, 'helm', chart=chart_name,
+                             cache_hit=False):
+                self._helm_stage(a_chart, o_path, info, cmd, cache_key,
+                                 cmd is h_pkg and native)
 
         chart_file = join(o_path, '{0}-{1}.tgz'.format(
             chart_name, chart_version))
@@ -481,9 +2280,316 @@ class Chart(Base):
         return chart_file
 
 
-class Docker(Base):
+class DockerArchive(Base):
+    """
+    Index of an image archive written by docker save, read directly from
+    its manifest.json so a subset of the images can be streamed into
+    docker load without unpacking the archive.
+    """
+
+    def __init__(self, docker_tar: str) -> None:
+        super().__init__()
+        self.path = docker_tar
+        self._tar = tarfile.open(docker_tar)
+        self._members = OrderedDict(
+            (posixpath.normpath(member.name), member)
+            for member in self._tar.getmembers())
+        self.manifest = self._read_json('manifest.json') or []
+
+    def close(self) -> None:
+        self._tar.close()
+
+    def _read_json(self, name: str) -> Any:
+        member = self._members.get(name)
+        if member is None or not member.isfile():
+            return None
+        with self._tar.extractfile(member) as _reader:
+            return json.load(_reader)
+
+    def tags(self) -> List[str]:
+        return [tag for entry in self.manifest
+                for tag in entry.get('RepoTags') or []]
+
+    def select(self, images: List[str]) -> List[Dict]:
+        wanted = set(ImageIndex.normalize(image) for image in images)
+        return [entry for entry in self.manifest
+                if wanted.intersection(ImageIndex.normalize(tag) for tag in
+                                       entry.get('RepoTags') or [])]
+
+    def _with_links(self, names: List[str]) -> List[str]:
+        resolved = []
+        pending = list(names)
+        while pending:
+            name = posixpath.normpath(pending.pop())
+            if name in resolved or name not in self._members:
+                continue
+            resolved.append(name)
+            member = self._members[name]
+            if member.issym():
+                pending.append(posixpath.join(posixpath.dirname(name),
+                                              member.linkname))
+            elif member.islnk():
+                pending.append(member.linkname)
+        return resolved
+
+    def _oci_index(self, configs: List[str]) -> Tuple[Optional[Dict],
+                                                       List[str]]:
+        index = self._read_json('index.json')
+        if not index:
+            return None, []
+        blobs = []
+        manifests = []
+        for descriptor in index.get('manifests', []):
+            _blob = 'blobs/{0}'.format(descriptor['digest'].replace(':', '/'))
+            _children = [_blob]
+            manifest = self._read_json(_blob) or {}
+            for child in manifest.get('manifests', []):
+                _child = 'blobs/{0}'.format(child['digest'].replace(':', '/'))
+                if _child in self._members:
+                    _children.append(_child)
+                    manifest = self._read_json(_child) or manifest
+            config = manifest.get('config', {}).get('digest', '')
+            if 'blobs/{0}'.format(config.replace(':', '/')) in configs:
+                manifests.append(descriptor)
+                blobs.extend(_children)
+        return dict(index, manifests=manifests), blobs
+
+    def stream(self, entries: List[Dict], writer: Any) -> int:
+        """
+        Write a docker load compatible tar containing only entries (items
+        of the archive manifest), their configs and layers to writer.
+        Returns the number of payload bytes written.
+        """
+        tags = set(tag for entry in entries
+                   for tag in entry.get('RepoTags') or [])
+        configs = [posixpath.normpath(entry['Config']) for entry in entries]
+        names = list(configs)
+        for entry in entries:
+            for layer in entry.get('Layers', []):
+                layer = posixpath.normpath(layer)
+                names.append(layer)
+                if posixpath.basename(layer) == 'layer.tar':
+                    _dir = posixpath.dirname(layer)
+                    names.append(_dir)
+                    names.extend(_name for _name in self._members
+                                 if posixpath.dirname(_name) == _dir)
+        oci_index, oci_blobs = self._oci_index(configs)
+        names.extend(oci_blobs)
+        if oci_index is not None and 'oci-layout' in self._members:
+            names.append('oci-layout')
+
+        documents = OrderedDict([('manifest.json', entries)])
+        repositories = self._read_json('repositories')
+        if repositories:
+            _repos = {}
+            for repo, repo_tags in repositories.items():
+                for _tag, _id in repo_tags.items():
+                    if '{0}:{1}'.format(repo, _tag) in tags:
+                        _repos.setdefault(repo, {})[_tag] = _id
+            documents['repositories'] = _repos
+        if oci_index is not None:
+            documents['index.json'] = oci_index
+
+        written = 0
+        selected = set(self._with_links(names))
+        with tarfile.open(fileobj=writer, mode='w|') as _out:
+            for name, member in self._members.items():
+                if name not in selected:
+                    continue
+                if member.isfile():
+                    with self._tar.extractfile(member) as _reader:
+                        _out.addfile(member, _reader)
+                    written += member.size
+                else:
+                    _out.addfile(member)
+            for name, document in documents.items():
+                data = json.dumps(document).encode()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                _out.addfile(info, io.BytesIO(data))
+        return written
+
+
+PushResult = namedtuple('PushResult', 'tag ok duration size error')
+
+
+class ImageIndex(Base):
+    """
+    The image tags known to the local docker daemon, read with a single
+    docker image ls call and kept up to date as tags are added or removed,
+    so existence checks don't each need a docker image inspect.
+    """
+
     def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self._tags = set()
+
+    @staticmethod
+    def normalize(tag: str) -> str:
+        for prefix in ['docker.io/library/', 'docker.io/']:
+            if tag.startswith(prefix):
+                tag = tag[len(prefix):]
+                break
+        if '@' not in tag and ':' not in tag.split('/')[-1]:
+            tag = '{0}:latest'.format(tag)
+        return tag
+
+    def refresh(self) -> 'ImageIndex':
+        # digests too, so repo@sha256:... references are found as well
+        command = ['docker', 'image', 'ls', '--digests', '--format',
+                   '{{.Repository}}:{{.Tag}} {{.Repository}}@{{.Digest}}']
+        _tags = set()
+        for line in self._execute_output(command).splitlines():
+            for reference in line.split():
+                if '<none>' not in reference:
+                    _tags.add(self.normalize(reference))
+        with self._lock:
+            self._tags = _tags
+        self.debug('DOCKER', 'Indexed {0} local image tags'.format(
+            len(_tags)))
+        return self
+
+    def exists(self, tag: str) -> bool:
+        with self._lock:
+            return self.normalize(tag) in self._tags
+
+    def add(self, tag: str) -> None:
+        with self._lock:
+            self._tags.add(self.normalize(tag))
+
+    def discard(self, tags: List[str]) -> None:
+        with self._lock:
+            for tag in tags:
+                self._tags.discard(self.normalize(tag))
+
+
+class PackageManagerWorker(Base):
+    """
+    Runs am-package-manager commands in one long-lived container.
+
+    start() launches the image detached with the given volumes and an idle
+    process, and run() dispatches each command into it with docker exec
+    and the image's own entrypoint. When the worker can't be started, the
+    image has no entrypoint, or persistent is False, every command falls
+    back to a one-shot docker run --rm. Use it as a context manager, or
+    call stop(), so the container is removed at the end.
+    """
+    DOCKER_SOCK = '/var/run/docker.sock:/var/run/docker.sock'
+
+    def __init__(self, image: str, volumes: List[str],
+                 persistent: bool = True) -> None:
+        super().__init__()
+        self._image = image
+        self._volumes = sorted(set(abspath(_v) for _v in volumes))
+        self._persistent = persistent
+        self._name = None
+        self._entrypoint = []
+
+    def _mounts(self) -> List[str]:
+        mounts = []
+        for volume in self._volumes:
+            mounts.extend(['-v', '{0}:{0}'.format(volume)])
+        return mounts + ['-v', self.DOCKER_SOCK]
+
+    def start(self) -> 'PackageManagerWorker':
+        if not self._persistent or self._name:
+            return self
+        name = 'cenm-sdk-pm-{0}'.format(uuid.uuid4().hex[:12])
+        try:
+            entrypoint = self._execute_output(
+                ['docker', 'image', 'inspect', '--format',
+                 '{{json .Config.Entrypoint}}', self._image]).strip()
+            self._entrypoint = json.loads(entrypoint or 'null') or []
+            if not self._entrypoint:
+                raise ValueError('{0} has no entrypoint to exec'.format(
+                    self._image))
+            self._execute(['docker', 'run', '-d', '--rm', '--name', name] +
+                          self._mounts() +
+                          ['--entrypoint', 'tail', self._image,
+                           '-f', '/dev/null'], log=False)
+        except (Exception, SystemExit) as error:
+            self.warn('DOCKER', 'Could not start a package manager worker, '
+                                'running one container per command: '
+                                '{0!r}'.format(error))
+            self._persistent = False
+            return self
+        self._name = name
+        self.info('DOCKER', 'Started package manager worker {0}'.format(
+            name))
+        return self
+
+    def run(self, args: List[str], cwd: str) -> float:
+        """
+        Run the package manager with args in the directory cwd.
+
+        :return: the time the command took
+        """
+        cwd = abspath(cwd)
+        if self._name:
+            command = ['docker', 'exec', '-w', cwd, self._name] + \
+                      self._entrypoint + args
+        else:
+            command = ['docker', 'run', '--rm'] + self._mounts() + \
+                      ['-w', cwd, self._image] + args
+        return self._execute(command)
+
+    def stop(self) -> None:
+        if not self._name:
+            return
+        name, self._name = self._name, None
+        try:
+            self._execute_output(['docker', 'rm', '-f', name])
+        except (Exception, SystemExit) as error:
+            self.warn('DOCKER', 'Could not remove package manager worker '
+                                '{0}: {1!r}'.format(name, error))
+            return
+        self.info('DOCKER', 'Stopped package manager worker {0}'.format(
+            name))
+
+    def __enter__(self) -> 'PackageManagerWorker':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+ChartResult = namedtuple('ChartResult', 'name status duration error')
+ChartPlan = namedtuple('ChartPlan', 'name chart_dir chart_fresh fp_chart '
+                                    'fp_images build_images')
+
+
+class Docker(Base):
+    INPUT_DIGEST_LABEL = 'com.ericsson.enm.sdk.input-digest'
+    BAKE_BUILDER = 'cenm-sdk'
+    BAKE_CACHE_DIR = '~/.cenm_sdk/cache/buildx'
+
+    def __init__(self, push_jobs: int = 1, reuse_images: bool = False,
+                 build_context: str = 'full') -> None:
         self._yaml = Yaml()
+        self._push_jobs = push_jobs
+        self._reuse_images = reuse_images
+        self._build_context = BuildContext() \
+            if build_context == 'minimal' else None
+        self._digests = Digests()
+        self._index = None
+        self._blob_stores = {}
+        self._blob_lock = threading.Lock()
+
+    def _blob_store(self, output_dir: str) -> BlobStore:
+        with self._blob_lock:
+            if output_dir not in self._blob_stores:
+                self._blob_stores[output_dir] = BlobStore(output_dir)
+            return self._blob_stores[output_dir]
+
+    def prune_blobs(self) -> None:
+        """
+        Remove unreferenced blobs from every blob store used in this run.
+        """
+        with self._blob_lock:
+            for store in self._blob_stores.values():
+                store.prune()
 
     def _update_dockerfile_packages_models(
         self,
@@ -503,12 +2609,9 @@ class Docker(Base):
         files = glob.glob1(inputs_jboss, "*.rpm")
         if not files:
            raise SystemExit('rpm files are not found !!! in models/uninstall folder')
-        for pkg in listdir(inputs_jboss):
-            pkg = str(pkg)
-            abs_pkg = join(inputs_jboss, pkg)
-            target = join(image_content, pkg)
-            self.info('DOCKER', 'Copying {0} to {1}'.format(abs_pkg, target))
-            shutil.copyfile(abs_pkg, target)
+        self._blob_store(dirname(chart_dir)).stage_all(
+            [join(inputs_jboss, str(_pkg)) for _pkg in listdir(inputs_jboss)],
+            image_content)
 
 
     def _update_dockerfile_packages(self, chart_name: str,
@@ -518,13 +2621,9 @@ class Docker(Base):
         image_content = join(chart_dir, 'image_content')
         inputs_jboss = join(sdk_input_path, chart_name, 'jboss')
 
-        for pkg in listdir(inputs_jboss):
-            pkg = str(pkg)
-            abs_pkg = join(inputs_jboss, pkg)
-            target = join(image_content, pkg)
-
-            self.info('DOCKER', 'Copying {0} to {1}'.format(abs_pkg, target))
-            shutil.copyfile(abs_pkg, target)
+        self._blob_store(dirname(chart_dir)).stage_all(
+            [join(inputs_jboss, str(_pkg)) for _pkg in listdir(inputs_jboss)],
+            image_content)
 
     def _update_dockerfile_scripts(self, chart_name: str, chart_dir: str,
                                    sdk_input_path: str):
@@ -554,7 +2653,7 @@ class Docker(Base):
             if not exists(script):
                 raise FileNotFoundError(script)
 
-            shutil.copy2(script, image_content)
+            self.copy_file(script, image_content)
             self.info('DOCKER',
                       'Adding {0} to image under {1}'.format(name, location))
             s_dockerfile.append(
@@ -563,8 +2662,7 @@ class Docker(Base):
 
         s_dockerfile = "".join(s_dockerfile)
 
-        with open(dockerfile, 'w') as _writer:
-            _writer.write(s_dockerfile)
+        self.write_file(dockerfile, s_dockerfile)
 
     def generate_images(self, chart_dir: str, sdk_input_path: str,
                         repository: str) -> None:
@@ -606,8 +2704,7 @@ class Docker(Base):
         s_dockerfile = Sed.replace_docker_arg(
             key_tag, sdk_image_version, s_dockerfile)
 
-        with open(dockerfile, 'w') as _writer:
-            _writer.write(s_dockerfile)
+        self.write_file(dockerfile, s_dockerfile)
 
     def generate_images_model(self, chart_dir: str, sdk_input_path: str,
                         repository: str, isinstall: bool) -> None:
@@ -658,11 +2755,95 @@ class Docker(Base):
         s_dockerfile = Sed.replace_docker_arg(
             key_tag, model_core_image_version, s_dockerfile)
 
-        with open(dockerfile, 'w') as _writer:
-            _writer.write(s_dockerfile)
+        self.write_file(dockerfile, s_dockerfile)
 
-    def _build_main_image(self, chart_dir: str, repository: str,
-                          sdk_input_path: str):
+    def _input_digest(self, dockerfile: str,
+                      context: str) -> Optional[str]:
+        """
+        Digest of everything a build depends on: the Dockerfile, the build
+        context and the local IDs of the FROM images. None when a FROM
+        image is not available locally, as the image the build will pull
+        is then unknown.
+        """
+        with open(dockerfile) as _reader:
+            s_dockerfile = _reader.read()
+        parts = [s_dockerfile, self._digests.tree_digest(context)]
+        for image in Dockerfile.from_images(s_dockerfile):
+            try:
+                parts.append(self._execute_output(
+                    ['docker', 'image', 'inspect', '--format', '{{.Id}}',
+                     image]).strip())
+            except SystemError:
+                self.debug('DOCKER', 'FROM image {0} is not local, no input '
+                                     'digest'.format(image))
+                return None
+        return self._digests.fingerprint(*parts)
+
+    def _find_image(self, input_digest: str) -> Optional[str]:
+        command = ['docker', 'image', 'ls', '--quiet', '--no-trunc',
+                   '--filter', 'label={0}={1}'.format(
+                       self.INPUT_DIGEST_LABEL, input_digest)]
+        try:
+            images = self._execute_output(command).split()
+        except SystemError:
+            return None
+        return images[0] if images else None
+
+    def _prepare_build(self, dockerfile: str, context: str, tag: str,
+                       cwd: str) -> Tuple[Optional[str], Dict[str, str]]:
+        """
+        Work out the build context and labels of a build. Every build is
+        labelled with its input digest, so later runs can reuse it. With
+        image reuse on, if an image with the same input digest already
+        exists it is re-tagged instead and the returned context is None.
+        """
+        labels = OrderedDict()
+        TRACER.annotate(tag=tag, cache_hit=False)
+        if self._build_context:
+            context = self._build_context.prepare(
+                dockerfile, context, join(dirname(cwd), '.sdk-contexts',
+                                          tag.split('/')[-1].split(':')[0]))
+        input_digest = self._input_digest(dockerfile, context)
+        if not input_digest:
+            self.info('DOCKER', 'A FROM image of {0} is not local, building '
+                                'it'.format(tag))
+            return context, labels
+        if self._reuse_images:
+            image_id = self._find_image(input_digest)
+            if image_id:
+                self.info('DOCKER', 'Input digest {0} hit, re-tagging {1} to '
+                                    '{2}'.format(input_digest[:12],
+                                                 image_id[:19], tag))
+                TRACER.annotate(cache_hit=True)
+                self._execute(['docker', 'tag', image_id, tag], log=VERBOSE)
+                return None, labels
+            self.info('DOCKER', 'Input digest {0} miss for {1}'.format(
+                input_digest[:12], tag))
+        labels[self.INPUT_DIGEST_LABEL] = input_digest
+        return context, labels
+
+    @TRACER.traced('docker build', 'docker')
+    def _docker_build(self, dockerfile: str, context: str, tag: str,
+                      cwd: str) -> None:
+        """
+        Build dockerfile as tag, labelled with the digest of its inputs.
+        If an image with the same input digest already exists it is
+        re-tagged instead of being built again.
+        """
+        context, labels = self._prepare_build(dockerfile, context, tag, cwd)
+        if context is None:
+            return
+        command = ['docker', 'build', '--network=host']
+        for label, value in labels.items():
+            command.extend(['--label', '{0}={1}'.format(label, value)])
+        command.extend(['--file', dockerfile, '-t', tag, context])
+        self.info('DOCKER', 'Building {0} with tag {1}'.format(
+            dockerfile, tag))
+        _time = self._execute(command, cwd)
+        self.info('DOCKER', 'Build took {0:.1f} seconds'.format(_time))
+
+    def _main_target(self, chart_dir: str, repository: str,
+                     sdk_input_path: str) -> Tuple[str, str, str]:
         dockerfile = join(chart_dir, 'Dockerfile')
 
         image_name = basename(chart_dir)
@@ -672,15 +2853,14 @@ class Docker(Base):
 
         tag = '{0}/{1}:{2}'.format(repository, image_name, version)
 
-        command = [
-            'docker', 'build', '--network=host',
-            '--file', dockerfile, '-t', tag, chart_dir
-        ]
+        return dockerfile, chart_dir, tag
 
-        self.info('DOCKER', 'Building {0} with tag {1}'.format(
-            dockerfile, tag))
-        _time = self._execute(command, chart_dir)
-        self.info('DOCKER', 'Build took {0} seconds'.format(_time))
+    def _build_main_image(self, chart_dir: str, repository: str,
+                          sdk_input_path: str):
+        dockerfile, context, tag = self._main_target(
+            chart_dir, repository, sdk_input_path)
+
+        self._docker_build(dockerfile, context, tag, chart_dir)
 
         return tag
 
@@ -693,6 +2873,15 @@ class Docker(Base):
         isinstall: bool,
     ) -> str:
         self.info("DOCKER", "Building model image")
+        dockerfile, tmpdir, tag = self._models_target(
+            chart_dir, repository, sdk_input_path, docker_file, isinstall)
+
+        self._docker_build(dockerfile, tmpdir, tag, chart_dir)
+        return tag
+
+    def _models_target(self, chart_dir: str, repository: str,
+                       sdk_input_path: str, docker_file: str,
+                       isinstall: bool) -> Tuple[str, str, str]:
         sdk_type = basename(sdk_input_path).lower()[0:2]
         chart_name = basename(chart_dir)
         folder_name = f"{chart_name}-models-{sdk_type}"
@@ -712,35 +2901,203 @@ class Docker(Base):
             version = build_opts[chart_name]["image-version"]
             tag = "{0}/{1}:{2}".format(repository, image_name, version)
 
-        command = [
-            "docker",
-            "build",
-            "--network=host",
-            "--file",
-            dockerfile,
-            "-t",
-            tag,
-            tmpdir,
-        ]
-        self.info("DOCKER", "Building {0} with tag {1}".format(dockerfile, tag))
-        _time = self._execute(command, chart_dir)
-        self.info("DOCKER", "Build took {0} seconds".format(_time))
-        return tag
+        return dockerfile, tmpdir, tag
+
+    def _ensure_builder(self, builder: str) -> None:
+        try:
+            self._execute_output(['docker', 'buildx', 'inspect', builder])
+            return
+        except SystemError:
+            pass
+        self.info('DOCKER', 'Creating buildx builder {0}'.format(builder))
+        self._execute(['docker', 'buildx', 'create', '--name', builder,
+                       '--driver', 'docker-container',
+                       '--driver-opt', 'network=host',
+                       '--buildkitd-flags',
+                       '--allow-insecure-entitlement network.host'],
+                      log=VERBOSE)
+
+    @TRACER.traced('docker bake', 'docker')
+    def bake_images(self, chart_dirs: List[str], repository: str,
+                    sdk_input_path: str,
+                    output_dir: str) -> Dict[str, List[str]]:
+        """
+        Build the main, models-install and remove-models images of every
+        chart in chart_dirs with a single docker buildx bake.
+
+        By default a docker-container builder builds them, and every image
+        exports its layer cache to its own directory under cache-dir and
+        imports the caches of all images, so layers are shared without
+        concurrent writes to one cache and survive on ephemeral nodes. If
+        that bake fails, for example because a FROM image only exists in
+        the local daemon, it is retried once with the daemon's docker
+        driver, without the local cache, and a warning shows why. Set
+        driver to docker to always use the daemon's driver and its layer
+        store. In ~/.cenm_sdk/config.yaml:
+
+            buildx:
+              bake:
+                driver: docker-container
+                builder: cenm-sdk
+                cache-dir: ~/.cenm_sdk/cache/buildx
+                cache-mode: max
+
+        :return: the image tags of each chart directory
+        """
+        options = self.get_command_options('buildx', 'bake')
+        driver = options.get('driver') or 'docker-container'
+        cache_dir = abspath(expandvars(expanduser(
+            options.get('cache-dir') or self.BAKE_CACHE_DIR)))
+        cache_mode = options.get('cache-mode') or 'max'
+
+        tags = OrderedDict()
+        targets = OrderedDict()
+        for chart_dir in sorted(chart_dirs):
+            tags[chart_dir] = []
+            for target in [
+                    self._main_target(chart_dir, repository, sdk_input_path),
+                    self._models_target(chart_dir, repository,
+                                        sdk_input_path, 'Dockerfile', True),
+                    self._models_target(chart_dir, repository,
+                                        sdk_input_path,
+                                        'Dockerfile-RemoveModels', False)]:
+                dockerfile, context, tag = target
+                tags[chart_dir].append(tag)
+                with TRACER.span('bake target', 'docker',
+                                 chart=basename(chart_dir)):
+                    context, labels = self._prepare_build(
+                        dockerfile, context, tag, chart_dir)
+                if context is None:
+                    continue
+                image_name = tag.split('/')[-1].split(':')[0]
+                targets[re.sub(r'[^\w-]', '_', image_name)] = OrderedDict([
+                    ('context', context), ('dockerfile', dockerfile),
+                    ('tags', [tag]), ('labels', labels), ('network', 'host'),
+                    ('output', ['type=docker'])])
+
+        if not targets:
+            self.info('DOCKER', 'All images are up to date, nothing to bake')
+            return tags
+
+        TRACER.annotate(targets=len(targets), driver=driver)
+        if driver == 'docker-container':
+            builder = options.get('builder') or self.BAKE_BUILDER
+            try:
+                self._bake(targets, builder, output_dir, cache_dir,
+                           cache_mode)
+            except SystemError as error:
+                tail = getattr(error, 'tail', None) or [str(error)]
+                self.warn('DOCKER', 'Bake with builder {0} and the layer '
+                                    'cache in {1} failed, retrying with the '
+                                    'docker driver without it. Last '
+                                    'output:\n  {2}'.format(
+                                        builder, cache_dir,
+                                        '\n  '.join(tail)))
+                TRACER.annotate(fallback='docker')
+                self._bake(targets, 'default', output_dir)
+        else:
+            self._bake(targets, options.get('builder') or 'default',
+                       output_dir)
+        if self._index:
+            for target in targets.values():
+                self._index.add(target['tags'][0])
+        return tags
+
+    def _bake(self, targets: Dict[str, Dict], builder: str, output_dir: str,
+              cache_dir: Optional[str] = None,
+              cache_mode: str = 'max') -> None:
+        """
+        Write the bake file of targets and run it with builder. With a
+        cache_dir, the builder is created if needed and a local layer
+        cache is exported per image and imported from every image.
+        """
+        targets = copy.deepcopy(targets)
+        if cache_dir:
+            self._ensure_builder(builder)
+            os.makedirs(cache_dir, exist_ok=True)
+            cache_from = ['type=local,src={0}'.format(join(cache_dir, _dir))
+                          for _dir in sorted(listdir(cache_dir))
+                          if exists(join(cache_dir, _dir, 'index.json'))]
+            for definition in targets.values():
+                image_name = definition['tags'][0].split('/')[-1].split(
+                    ':')[0]
+                definition['cache-to'] = [
+                    'type=local,dest={0},mode={1}'.format(
+                        join(cache_dir, image_name), cache_mode)]
+                if cache_from:
+                    definition['cache-from'] = cache_from
+
+        bake_file = join(output_dir, '.sdk-bake.json')
+        self.write_file(bake_file, json.dumps(OrderedDict([
+            ('group', {'default': {'targets': list(targets)}}),
+            ('target', targets)]), indent=2))
+        self.info('DOCKER', 'Baking {0} images with builder {1}{2}'.format(
+            len(targets), builder,
+            ', layer cache in {0}'.format(cache_dir) if cache_dir else ''))
+        _time = self._execute(['docker', 'buildx', 'bake', '--builder',
+                               builder, '--file', bake_file,
+                               '--allow', 'network.host',
+                               '--progress', 'plain'], output_dir)
+        self.info('DOCKER', 'Bake took {0:.1f} seconds'.format(_time))
+
+    def _timed_build(self, prefix: Optional[str], build,
+                     *args) -> Tuple[str, float]:
+        _start = time.perf_counter()
+        tag = self.with_log_prefix(prefix, build, *args)
+        return tag, time.perf_counter() - _start
 
     def build_image(self, chart_dir: str, repository: str,
                     sdk_input_path: str) -> List[str]:
-        tag_main = self._build_main_image(chart_dir, repository,
-                                          sdk_input_path)
-        tag_model = self._build_models_image(
-            chart_dir, repository, sdk_input_path, "Dockerfile", True
-        )
-        tag_model_uninstall = self._build_models_image(
-            chart_dir, repository, sdk_input_path, "Dockerfile-RemoveModels", False
+        """
+        Build the main, models-install and remove-models images of a chart.
+        The three builds use separate Dockerfiles and contexts so they are
+        run at the same time; the first failing build is re-raised once all
+        of them have finished.
+        """
+        builds = (
+            ('main', self._build_main_image,
+             (chart_dir, repository, sdk_input_path)),
+            ('models-install', self._build_models_image,
+             (chart_dir, repository, sdk_input_path, "Dockerfile", True)),
+            ('remove-models', self._build_models_image,
+             (chart_dir, repository, sdk_input_path,
+              "Dockerfile-RemoveModels", False))
         )
-
-        return [x for x in [tag_main, tag_model, tag_model_uninstall] if x]
-
-    def _exec_with_retry(self, command: List[str]) -> int:
+        parent_prefix = self.get_log_prefix()
+        tags = OrderedDict()
+        timings = OrderedDict()
+        first_error = None
+        _start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(builds)) as executor:
+            futures = OrderedDict()
+            for name, build, args in builds:
+                _prefix = '/'.join([x for x in [parent_prefix, name] if x])
+                futures[executor.submit(
+                    self._timed_build, _prefix, build, *args)] = name
+
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    tags[name], timings[name] = future.result()
+                except (Exception, SystemExit) as error:
+                    if first_error is None:
+                        first_error = error
+                        self.error('DOCKER', 'Building {0} image failed: '
+                                             '{1!r}'.format(name, error))
+
+        for name, _time in timings.items():
+            self.info('DOCKER', '{0} image build took {1:.1f} seconds'.format(
+                name, _time))
+        self.info('DOCKER', 'Image builds took {0:.1f} seconds ({1:.1f} '
+                            'seconds if run one after another)'.format(
+                                time.perf_counter() - _start,
+                                sum(timings.values())))
+        if first_error:
+            raise first_error
+
+        return [tags[name] for name, _, _ in builds if tags.get(name)]
+
+    def _exec_with_retry(self, command: List[str]) -> float:
         try_count = 0
         while True:
             try:
@@ -751,98 +3108,227 @@ class Docker(Base):
                     raise error
                 self.warn('DOCKER', 'Docker command failed, trying again ...')
 
-    def push_images(self, tags: List[str]) -> None:
-        for tag in tags:
-            command = ['docker', 'push', tag]
-            self.info('DOCKER', 'Pushing {0}'.format(tag))
-            _time = self._exec_with_retry(command)
-            self.info('DOCKER', 'Push took {0} seconds'.format(_time))
+    def image_size(self, tag: str) -> Optional[int]:
+        command = ['docker', 'image', 'inspect', '--format', '{{.Size}}', tag]
+        try:
+            return int(self._execute_output(command).strip())
+        except (SystemError, ValueError):
+            return None
+
+    @TRACER.traced('docker push', 'docker')
+    def _push_image(self, tag: str) -> PushResult:
+        size = self.image_size(tag)
+        TRACER.annotate(tag=tag, bytes=size)
+        self.info('DOCKER', 'Pushing {0} ({1})'.format(
+            tag, self.format_size(size)))
+        _start = time.perf_counter()
+        try:
+            self._exec_with_retry(['docker', 'push', tag])
+        except SystemError as error:
+            _time = time.perf_counter() - _start
+            self.error('DOCKER', 'Push of {0} failed after {1:.1f} '
+                                 'seconds'.format(tag, _time))
+            return PushResult(tag, False, _time, size, error)
+        _time = time.perf_counter() - _start
+        self.info('DOCKER', 'Push of {0} took {1:.1f} seconds'.format(
+            tag, _time))
+        return PushResult(tag, True, _time, size, None)
+
+    def push_images(self, tags: List[str],
+                    jobs: Optional[int] = None) -> List[PushResult]:
+        """
+        Push tags with up to jobs (default: the push_jobs the instance was
+        created with) pushes running at the same time. Every tag is
+        attempted; a SystemError listing the failed tags is raised after
+        the push report has been logged.
+        """
+        if not tags:
+            return []
+        jobs = max(1, min(jobs or self._push_jobs, len(tags)))
+        prefix = self.get_log_prefix()
+        _start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(
+                lambda _tag: self.with_log_prefix(
+                    prefix, self._push_image, _tag), tags))
+        self._push_report(results, time.perf_counter() - _start)
+
+        failed = [result.tag for result in results if not result.ok]
+        if failed:
+            raise SystemError('Failed to push {0} of {1} images: {2}'.format(
+                len(failed), len(results), ', '.join(failed)))
+        return results
+
+    def _push_report(self, results: List[PushResult], elapsed: float) -> None:
+        self.info('DOCKER', 'Push report:')
+        for result in results:
+            self.info('DOCKER', '  {0:<8} {1:>8.1f}s {2:>10} {3}'.format(
+                'OK' if result.ok else 'FAILED', result.duration,
+                self.format_size(result.size), result.tag))
+        pushed = [result for result in results if result.ok]
+        self.info('DOCKER', 'Pushed {0} of {1} images ({2}) in {3:.1f} '
+                            'seconds'.format(
+                                len(pushed), len(results),
+                                self.format_size(sum(
+                                    r.size for r in pushed if r.size)),
+                                elapsed))
+
+    @TRACER.traced('docker load', 'docker')
+    def load_images(self, docker_tar: str,
+                    images: Optional[List[str]] = None) -> None:
+        """
+        Load docker_tar into the daemon. If images is given only those
+        images, with their configs and layers, are streamed into docker load.
+        """
+        if images is not None:
+            archive = DockerArchive(docker_tar)
+            try:
+                entries = archive.select(images)
+                if archive.manifest and len(entries) < len(archive.manifest):
+                    self._load_selected(archive, entries)
+                    return
+            finally:
+                archive.close()
 
-    def load_images(self, docker_tar: str) -> None:
         command = ['docker', 'load', '--input', docker_tar]
         _time = self._exec_with_retry(command)
         self.info('DOCKER', 'Load took {0} seconds'.format(_time))
 
-    def exists(self, tag: str):
-        command = ['docker', 'image', 'inspect', tag]
-        try:
-            self._execute(command, log=False)
-            return True
-        except SystemError:
-            return False
+    def _load_selected(self, archive: DockerArchive,
+                       entries: List[Dict]) -> None:
+        if not entries:
+            self.info('DOCKER', 'All images in {0} are already '
+                                'present, skipping load'.format(archive.path))
+            return
+        self.info('DOCKER', 'Loading {0} of {1} images from {2}'.format(
+            len(entries), len(archive.manifest), archive.path))
+        try_count = 0
+        while True:
+            _start = time.perf_counter()
+            process = subprocess.Popen(
+                ['docker', 'load'], stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = []
+            reader = threading.Thread(
+                target=lambda: output.extend(process.stdout.readlines()))
+            reader.start()
+            try:
+                written = archive.stream(entries, process.stdin)
+                process.stdin.close()
+            except BrokenPipeError:
+                written = 0
+            reader.join()
+            process.wait()
+            for line in output:
+                if VERBOSE:
+                    self.info('PROCESS', line.decode().strip())
+            if process.returncode == 0:
+                break
+            try_count += 1
+            if try_count >= 3:
+                raise CommandError(['docker', 'load'], process.returncode, [
+                    _line.decode(errors='replace').strip()
+                    for _line in output[-CommandRunner.TAIL_LINES:]])
+            self.warn('DOCKER', 'Docker command failed, trying again ...')
+
+        TRACER.annotate(images=len(entries), bytes=written)
+        self.info('DOCKER', 'Load of {0} took {1:.1f} seconds'.format(
+            self.format_size(written), time.perf_counter() - _start))
+
+    def image_index(self, refresh: bool = False) -> ImageIndex:
+        if self._index is None or refresh:
+            self._index = ImageIndex().refresh()
+        return self._index
 
     def remove(self, tags: List[str]) -> None:
+        """
+        Remove tags with one docker rmi. A tag that can't be removed is
+        logged and left in place, it doesn't stop the caller.
+        """
+        tags = list(OrderedDict.fromkeys(tags))
+        if not tags:
+            return
         for tag in tags:
-            command = ['docker', 'rmi', '--force', tag]
             self.info('DOCKER', 'Removing tag {0}'.format(tag))
+        command = ['docker', 'rmi', '--force'] + tags
+        try:
+            # docker rmi tries every tag before it reports a failure
             self._execute(command, log=VERBOSE)
+        except SystemError as error:
+            self.warn('DOCKER', 'Some tags could not be removed: '
+                                '{0}'.format(error))
+            if self._index:
+                self._index.refresh()
+            return
+        if self._index:
+            self._index.discard(tags)
 
-    def retag(self, tag, new_tag):
-        self.info('DOCKER', 'Re-tagging {0} to {1}'.format(tag, new_tag))
-        command = ['docker', 'tag', tag, new_tag]
-        self._execute(command, log=VERBOSE)
+    def retag_many(self, pairs: List[Tuple[str, str]]) -> None:
+        """
+        Run docker tag for every (tag, new_tag) pair concurrently.
+        """
+        for tag, new_tag in pairs:
+            self.info('DOCKER', 'Re-tagging {0} to {1}'.format(tag, new_tag))
+        self._execute_many([['docker', 'tag', tag, new_tag]
+                            for tag, new_tag in pairs], log=VERBOSE)
+        if self._index:
+            for _, new_tag in pairs:
+                self._index.add(new_tag)
 
     def preparecsar(self, output_dir: str, csar_name: str,
                     sdk_inputpath: str, am_package_manager: str,
-                    light: bool):
+                    light: bool, jobs: int = 1, persistent: bool = True):
+        """
+        Create a CSAR for every chart archive in output_dir.
+        Each chart is staged in its own work directory under
+        output_dir/csar/<chart archive name> holding its manifest, vnfd and
+        scripts, so up to jobs package-manager commands can run at once.
+        With persistent set and more than one chart, they run in one worker
+        container that is removed at the end, otherwise in one container
+        each.
+        """
         output_dir = abspath(output_dir)
         self.info('DOCKER', 'Re-Building Csar with Custom dir volume')
-        for custom_chart_name in listdir(output_dir):
-            if custom_chart_name.endswith(".tgz"):
-                volume = output_dir + ':' + output_dir
-                docker_sock = '/var/run/docker.sock:/var/run/docker.sock'
-
-                manifest_path = abspath(
-                    join(basename(__file__), '..', '..', 'templates', 'csar',
-                         'manifest'))
-                _parent = join(output_dir, 'manifest')
-                if not isdir(_parent):
-                    os.makedirs(_parent, exist_ok=True)
-
-                for _file in os.listdir(manifest_path):
-                    shutil.copy(join(manifest_path, _file), _parent)
-
-                vnfd_path = abspath(
-                    join(basename(__file__), '..', '..', 'templates', 'csar',
-                         'vnfd'))
-                _parent = join(output_dir, 'vnfd')
-                if not isdir(_parent):
-                    os.makedirs(_parent, exist_ok=True)
-
-                for _file in os.listdir(vnfd_path):
-                    shutil.copy(join(vnfd_path, _file), _parent)
-
-                # make dir under output_dir
-                # mkdir(output_dir+'/scripts')
-                chartname = splitext(custom_chart_name)[0]
-                chart_name_folder = re.split(r'(\-\d.+|\-\d+(\.\d+))$',
-                                             chartname)
-                rpmlocation = abspath(
-                    sdk_inputpath + '/' + chart_name_folder[0] + '/models/')
-
-                _parent = join(output_dir, 'scripts')
-                if not isdir(_parent):
-                    os.makedirs(_parent, exist_ok=True)
-
-                for _file in os.listdir(rpmlocation):
-                    shutil.copy(join(rpmlocation, _file), _parent)
-
-                Base().replace_value(
-                    output_dir + '/manifest/fmsdk_descriptor.mf',
-                    chart_name_folder[0], '<<PRODUCT>>')
-                Base().replace_value(
-                    output_dir + '/vnfd/fmsdk_descriptor.yaml',
-                    chart_name_folder[0], '<<PRODUCT>>')
-                Base().replace_value(
-                    output_dir + '/vnfd/fmsdk_descriptor.yaml',
-                    str(uuid.uuid1()), '<<DESCRIPTOR_ID>>')
-                Base().replace_value(
-                    output_dir + '/vnfd/fmsdk_descriptor.yaml',
-                    str(custom_chart_name), '<<CHART>>')
-                command = ['docker', 'run', '--rm', '-v', volume,
-                           '-v', docker_sock, '-w', output_dir,
-                           am_package_manager,
-                           'generate', '--helm3', '-hm', custom_chart_name,
+        charts = sorted(_file for _file in listdir(output_dir)
+                        if _file.endswith('.tgz'))
+        if not charts:
+            self.info('DOCKER', 'no chart found')
+            return
+
+        jobs = max(1, min(jobs, len(charts)))
+        results = OrderedDict(
+            (_chart, ChartResult(_chart, 'SKIPPED', 0.0, None))
+            for _chart in charts)
+        with PackageManagerWorker(am_package_manager, [output_dir],
+                                  persistent and len(charts) > 1) as pm, \
+                ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(
+                self.with_log_prefix, _chart if jobs > 1 else None,
+                self._chart_csar, output_dir, _chart, csar_name,
+                sdk_inputpath, pm, light)
+                for _chart in charts]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result.name] = result
+                if result.error:
+                    self.error('DOCKER', 'CSAR of {0} failed: {1!r}'.format(
+                        result.name, result.error))
+
+        self.result_summary('DOCKER', 'CSAR summary:', results.values())
+        for result in results.values():
+            if result.error:
+                raise result.error
+
+    def _chart_csar(self, output_dir: str, custom_chart_name: str,
+                    csar_name: str, sdk_inputpath: str,
+                    pm: PackageManagerWorker, light: bool) -> ChartResult:
+        _start = time.perf_counter()
+        try:
+            with TRACER.span('chart csar', 'csar', chart=custom_chart_name):
+                work_dir = self._stage_chart_csar(
+                    output_dir, custom_chart_name, sdk_inputpath)
+                command = ['generate', '--helm3',
+                           '-hm', join(output_dir, custom_chart_name),
                            '--name', csar_name,
                            '-sc', 'scripts',
                            '-mf', 'manifest/fmsdk_descriptor.mf',
@@ -852,21 +3338,81 @@ class Docker(Base):
                     command.append('--no-images')
                 self.info('DOCKER',
                           'Creating CSAR from {0} '.format(custom_chart_name))
-                self._execute(command)
-            else:
-                self.info('DOCKER', 'no chart found')
+                pm.run(command, work_dir)
+        except (Exception, SystemExit) as error:
+            return ChartResult(custom_chart_name, 'FAILED',
+                               time.perf_counter() - _start, error)
+        self.info('DOCKER', 'Generated {0}'.format(
+            join(work_dir, '{0}.csar'.format(csar_name))))
+        return ChartResult(custom_chart_name, 'OK',
+                           time.perf_counter() - _start, None)
+
+    def _stage_chart_csar(self, output_dir: str, custom_chart_name: str,
+                          sdk_inputpath: str) -> str:
+        """
+        Fill a fresh work directory with the manifest, vnfd and scripts of
+        one chart archive.
+
+        :return: the work directory
+        """
+        chartname = splitext(custom_chart_name)[0]
+        chart_name_folder = re.split(r'(\-\d.+|\-\d+(\.\d+))$', chartname)
+        work_dir = join(output_dir, 'csar', chartname)
+        if isdir(work_dir):
+            shutil.rmtree(work_dir)
+
+        templates = self.csar_templates()
+        for _dir in ['manifest', 'vnfd']:
+            shutil.copytree(join(templates, _dir), join(work_dir, _dir))
+
+        rpmlocation = abspath(
+            sdk_inputpath + '/' + chart_name_folder[0] + '/models/')
+        _parent = join(work_dir, 'scripts')
+        os.makedirs(_parent, exist_ok=True)
+        self._blob_store(output_dir).stage_all(
+            [join(rpmlocation, _file)
+             for _file in os.listdir(rpmlocation)], _parent)
+
+        self.render_template(
+            join(work_dir, 'manifest', 'fmsdk_descriptor.mf'),
+            {'<<PRODUCT>>': chart_name_folder[0]})
+        self.render_template(
+            join(work_dir, 'vnfd', 'fmsdk_descriptor.yaml'),
+            {'<<PRODUCT>>': chart_name_folder[0],
+             '<<DESCRIPTOR_ID>>': str(uuid.uuid1()),
+             '<<CHART>>': str(custom_chart_name)})
+        return work_dir
 
 
 class SdkBuildManager(Base):
 
-    def __init__(self) -> None:
+    def __init__(self, push_jobs: int = 1, use_cache: bool = False,
+                 staging: str = 'copy', template_cache: Optional[str] = None,
+                 template_cache_size: int = Tar.CACHE_SIZE,
+                 chart_packager: str = 'helm',
+                 compress_level: int = ChartPackager.COMPRESS_LEVEL,
+                 build_context: str = 'full',
+                 build_backend: str = 'build',
+                 csar_writer: str = 'package-manager',
+                 package_manager_worker: bool = True) -> None:
         super().__init__()
-        self._chart = Chart()
-        self._docker = Docker()
-
+        self._pm_worker = package_manager_worker
+        self._build_backend = build_backend
+        self._csar_writer = CsarWriter() \
+            if csar_writer == 'native' else None
+        self._tar = Tar(template_cache, template_cache_size)
+        self._staging = Staging(staging)
+        self._chart = Chart(self._staging,
+                            HelmCache() if use_cache else None,
+                            ChartPackager(compress_level)
+                            if chart_packager == 'native' else None)
+        self._docker = Docker(push_jobs, use_cache, build_context)
+
+    @TRACER.traced('generate_chart', 'build')
     def generate_chart(self, sdk_path: str, sdk_input_path: str,
                        repository: str, output_dir: str,
-                       overwrite: bool) -> None:
+                       overwrite: bool, jobs: int = 1,
+                       use_cache: bool = False) -> None:
         """
         Take the SDK chart template and create a custom SDK chart
         with Dockerfile. The Dockerfile wil lbe build and pushed to
@@ -876,44 +3422,274 @@ class SdkBuildManager(Base):
         :param repository: Local docker repository
         :param output_dir: Where to generate the custom chart
         :param overwrite: Overwrite existing files if they exist.
+        :param jobs: Number of custom charts to build at the same time
+        :param use_cache: Skip stages whose inputs did not change since the
+         last successful run into output_dir
         :return:
         """
         sdk_path = abspath(sdk_path)
         sdk_input_path = abspath(sdk_input_path)
         output_dir = abspath(output_dir)
 
-        tar = Tar()
         if not isdir(sdk_path) and tarfile.is_tarfile(sdk_path):
-            templates_dir = tar.extract_tar(sdk_path, overwrite)
+            templates_dir = self._tar.extract_tar(sdk_path, overwrite)
         else:
             templates_dir = sdk_path
 
-        for custom_chart_name in listdir(sdk_input_path):
-            chart_dir, chart_version = self._chart.generate_custom_chart(
-                templates_dir, custom_chart_name,
-                sdk_input_path, output_dir,
-                overwrite, repository)
+        cache = None
+        if use_cache:
+            os.makedirs(output_dir, exist_ok=True)
+            cache = StageCache(output_dir)
+            templates_digest = cache.tree_digest(sdk_path, abspath(__file__))
+        else:
+            templates_digest = None
+
+        chart_names = listdir(sdk_input_path)
+        jobs = max(1, min(jobs, len(chart_names) or 1))
+        if jobs > 1:
+            self.info('SdkBuildManager', 'Building {0} charts with {1} '
+                                         'jobs'.format(len(chart_names), jobs))
+
+        stop = threading.Event()
+
+        def _build(_name):
+            plan = self._prepare_custom_chart(
+                templates_dir, _name, sdk_input_path, repository,
+                output_dir, overwrite, cache, templates_digest)
+            tags = []
+            if plan.build_images:
+                tags = self._docker.build_image(plan.chart_dir, repository,
+                                                sdk_input_path)
+            self._finish_custom_chart(plan, tags, sdk_input_path,
+                                      output_dir, cache)
+
+        if self._build_backend == 'bake':
+            results, failure = self._bake_custom_charts(
+                templates_dir, chart_names, sdk_input_path, repository,
+                output_dir, overwrite, jobs, stop, cache, templates_digest)
+        else:
+            results, failure = self._run_chart_jobs(chart_names, jobs, stop,
+                                                    _build)
 
-            self._chart.merge_custom_chart_config(
-                chart_dir, custom_chart_name, sdk_input_path)
+        self._chart_summary(results.values())
+        if failure:
+            raise failure.error
 
-            self._docker.generate_images(chart_dir, sdk_input_path,
-                                         repository)
+    def _run_chart_jobs(self, chart_names: List[str], jobs: int,
+                        stop: threading.Event, work,
+                        span: str = 'custom chart'
+                        ) -> Tuple[OrderedDict, Optional[ChartResult]]:
+        """
+        Call work(chart_name) for every chart with up to jobs charts at a
+        time. After the first failure no further chart is started.
+        """
+        results = OrderedDict(
+            (_name, ChartResult(_name, 'SKIPPED', 0.0, None))
+            for _name in chart_names)
+        failure = None
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = []
+            for custom_chart_name in chart_names:
+                _prefix = custom_chart_name if jobs > 1 else None
+                futures.append(executor.submit(
+                    self.with_log_prefix, _prefix, self._chart_job,
+                    custom_chart_name, stop, work, span))
+
+            for future in as_completed(futures):
+                result = future.result()
+                results[result.name] = result
+                if result.error and not failure:
+                    failure = result
+                    self.error('SdkBuildManager', 'Building {0} failed: '
+                                                  '{1!r}'.format(
+                                                      result.name,
+                                                      result.error))
+        return results, failure
+
+    def _chart_job(self, custom_chart_name: str, stop: threading.Event,
+                   work, span: str) -> ChartResult:
+        if stop.is_set():
+            return ChartResult(custom_chart_name, 'SKIPPED', 0.0, None)
+        _start = time.perf_counter()
+        try:
+            with TRACER.span(span, 'chart', chart=custom_chart_name):
+                work(custom_chart_name)
+        except (Exception, SystemExit) as error:
+            stop.set()
+            return ChartResult(custom_chart_name, 'FAILED',
+                               time.perf_counter() - _start, error)
+        return ChartResult(custom_chart_name, 'OK',
+                           time.perf_counter() - _start, None)
+
+    def _bake_custom_charts(self, templates_dir: str, chart_names: List[str],
+                            sdk_input_path: str, repository: str,
+                            output_dir: str, overwrite: bool, jobs: int,
+                            stop: threading.Event,
+                            cache: Optional[StageCache],
+                            templates_digest: Optional[str]
+                            ) -> Tuple[OrderedDict, Optional[ChartResult]]:
+        """
+        Generate every chart and its Dockerfiles, build all images with one
+        docker buildx bake, then push the images and package each chart.
+        """
+        plans = OrderedDict()
 
-            self._docker.generate_images_model(
-                chart_dir, sdk_input_path, repository, True
-            )
+        def _prepare(_name):
+            plans[_name] = self._prepare_custom_chart(
+                templates_dir, _name, sdk_input_path, repository,
+                output_dir, overwrite, cache, templates_digest)
 
-            self._docker.generate_images_model(
-                chart_dir, sdk_input_path, repository, False
-            )
+        results, failure = self._run_chart_jobs(chart_names, jobs, stop,
+                                                 _prepare, 'prepare chart')
+        if failure:
+            return results, failure
 
-            tags = self._docker.build_image(chart_dir, repository,
-                                            sdk_input_path)
+        # plans is filled in completion order
+        plans = OrderedDict(sorted(plans.items()))
+        try:
+            tags = self._docker.bake_images(
+                [_plan.chart_dir for _plan in plans.values()
+                 if _plan.build_images], repository, sdk_input_path,
+                output_dir)
+        except (Exception, SystemExit) as error:
+            self.error('SdkBuildManager', 'Baking images failed: '
+                                          '{0!r}'.format(error))
+            for plan in plans.values():
+                if plan.build_images:
+                    results[plan.name] = results[plan.name]._replace(
+                        status='FAILED', error=error)
+            failed = next((_plan.name for _plan in plans.values()
+                           if _plan.build_images), None)
+            if failed is None:
+                raise Exception('Baking images failed although no chart '
+                                'had images to build: {0!r}'.format(
+                                    error)) from error
+            return results, results[failed]
+
+        def _finish(_name):
+            plan = plans[_name]
+            self._finish_custom_chart(plan, tags.get(plan.chart_dir, []),
+                                      sdk_input_path, output_dir, cache)
+
+        finished, failure = self._run_chart_jobs(list(plans), jobs, stop,
+                                                 _finish, 'finish chart')
+        for name, result in finished.items():
+            results[name] = result._replace(
+                duration=results[name].duration + result.duration)
+        return results, failure
+
+    def _prepare_custom_chart(self, templates_dir: str,
+                              custom_chart_name: str,
+                              sdk_input_path: str, repository: str,
+                              output_dir: str, overwrite: bool,
+                              cache: Optional[StageCache],
+                              templates_digest: Optional[str]) -> ChartPlan:
+        """
+        Run the chart stage of one custom chart and, unless its images are
+        up to date, generate their Dockerfiles and contexts.
+        With a cache, the chart stage depends on the templates and the
+        config folder, the images stage on the templates, build.yaml and
+        the jboss, models, uninstall and scripts folders, and the package
+        stage on the chart stage.
+        """
+        chart_dir = join(output_dir, custom_chart_name)
+        chart_inputs = join(sdk_input_path, custom_chart_name)
+        if cache:
+            fp_chart = cache.fingerprint(
+                'chart', templates_digest, custom_chart_name, repository,
+                cache.tree_digest(join(chart_inputs, 'config')))
+            fp_images = cache.fingerprint(
+                'images', templates_digest, custom_chart_name, repository,
+                cache.tree_digest(*[join(chart_inputs, _input) for _input in [
+                    join('config', 'build.yaml'), 'jboss', 'models',
+                    'uninstall', 'scripts']]))
+        else:
+            fp_chart = fp_images = None
+
+        chart_fresh = bool(cache) and cache.is_fresh(
+            custom_chart_name, 'chart', fp_chart) and isdir(
+            join(chart_dir, 'chart', custom_chart_name))
+        if chart_fresh:
+            self.info('CACHE', 'Chart inputs of {0} unchanged, skipping chart '
+                               'generation'.format(custom_chart_name))
+            TRACER.annotate(chart_cache_hit=True)
+        else:
+            workspace = ChartWorkspace()
+            with TRACER.span('generate chart', 'chart',
+                             chart=custom_chart_name):
+                chart_dir, _ = self._chart.generate_custom_chart(
+                    templates_dir, custom_chart_name,
+                    sdk_input_path, output_dir,
+                    overwrite, repository, workspace)
+
+            self._chart.merge_custom_chart_config(
+                chart_dir, custom_chart_name, sdk_input_path, workspace)
+            with TRACER.span('write chart', 'chart', chart=custom_chart_name):
+                workspace.flush()
+            if cache:
+                cache.update(custom_chart_name, 'chart', fp_chart)
+
+        build_images = True
+        if cache and cache.is_fresh(custom_chart_name, 'images', fp_images):
+            self.info('CACHE', 'Image inputs of {0} unchanged, skipping image '
+                               'builds'.format(custom_chart_name))
+            TRACER.annotate(images_cache_hit=True)
+            build_images = False
+        else:
+            if chart_fresh:
+                self._chart.stage_image_context(
+                    templates_dir, chart_dir, custom_chart_name,
+                    sdk_input_path)
+
+            with TRACER.span('generate Dockerfiles', 'docker',
+                             chart=custom_chart_name):
+                self._docker.generate_images(chart_dir, sdk_input_path,
+                                             repository)
+
+                self._docker.generate_images_model(
+                    chart_dir, sdk_input_path, repository, True
+                )
+
+                self._docker.generate_images_model(
+                    chart_dir, sdk_input_path, repository, False
+                )
+
+        return ChartPlan(custom_chart_name, chart_dir, chart_fresh, fp_chart,
+                         fp_images, build_images)
+
+    def _finish_custom_chart(self, plan: ChartPlan, tags: List[str],
+                             sdk_input_path: str, output_dir: str,
+                             cache: Optional[StageCache]) -> None:
+        """
+        Push the images built for plan and run the package stage.
+        """
+        custom_chart_name = plan.name
+        if plan.build_images:
             self._docker.push_images(tags)
+            if cache:
+                cache.update(custom_chart_name, 'images', plan.fp_images)
+
+        chart_version = self._chart.get_chart_version(
+            custom_chart_name, sdk_input_path)
+        chart_file = join(output_dir, '{0}-{1}.tgz'.format(
+            custom_chart_name, chart_version))
+        if plan.chart_fresh and cache.is_fresh(
+                custom_chart_name, 'package', plan.fp_chart) and \
+                exists(chart_file):
+            self.info('CACHE', 'Chart {0} unchanged, keeping {1}'.format(
+                custom_chart_name, chart_file))
+            TRACER.annotate(package_cache_hit=True)
+        else:
+            self._chart.package(plan.chart_dir, custom_chart_name,
+                                sdk_input_path)
+            if cache:
+                cache.update(custom_chart_name, 'package', plan.fp_chart)
 
-            self._chart.package(chart_dir, custom_chart_name, sdk_input_path)
+    def _chart_summary(self, results: Any) -> None:
+        self.result_summary('SdkBuildManager', 'Chart build summary:',
+                            results)
 
+    @TRACER.traced('integration_chart', 'csar')
     def integration_chart(self, chart_yaml: str, template: str,
                           output_dir: str) -> Tuple[str, str, str]:
         _chart = Yaml().load(chart_yaml)
@@ -924,12 +3700,11 @@ class SdkBuildManager(Base):
 
         sdk_integ_chart = join(output_dir, 'integration', _name_version)
 
-        tar = Tar()
-        e_template = tar.extract_tar(template, True)
+        e_template = self._tar.extract_tar(template, True)
 
         if isdir(sdk_integ_chart):
             shutil.rmtree(sdk_integ_chart)
-        shutil.copytree(e_template, sdk_integ_chart)
+        self._staging.copytree(e_template, sdk_integ_chart)
 
         integ_chart = Yaml()
         chart_data = integ_chart.load(join(sdk_integ_chart, 'Chart.yaml'))
@@ -938,9 +3713,10 @@ class SdkBuildManager(Base):
 
         integ_chart.dump(chart_data, join(sdk_integ_chart, 'Chart.yaml'))
 
-        helm = Chart()
+        helm = self._chart
         return helm.package(sdk_integ_chart), _name, _version
 
+    @TRACER.traced('prepare_csar', 'csar')
     def prepare_csar(self, csar_name: str, csar_version: str,
                      chart: str, product_set: str,
                      output_dir: str) -> Tuple[str, str, str]:
@@ -957,14 +3733,7 @@ class SdkBuildManager(Base):
             os.makedirs(_csar_charts, exist_ok=True)
         shutil.copyfile(chart, join(_csar_charts, _chart_filename))
 
-        templates = abspath(join(dirname(__file__), '..', 'templates', 'csar'))
-        if not isdir(templates):
-            _git = abspath(join(dirname(__file__),
-                                '..', 'fmsdk_bm_csar_source'))
-            if isdir(_git):
-                templates = _git
-            else:
-                raise FileNotFoundError(templates)
+        templates = self.csar_templates()
 
         t_manifest = join(templates, 'manifest', 'fmsdk_descriptor.mf')
         manifest = join(build_dir, 'manifest', 'sdk_descriptor.mf')
@@ -989,23 +3758,17 @@ class SdkBuildManager(Base):
         ]
 
         for _file in [manifest, vnfd]:
-            for _change in changes:
-                self.info('SdkBuildManager',
-                          'Updating {0} with {1}'.format(_file, _change[1]))
-                Base().replace_value(_file, _change[1], _change[0])
+            self.info('SdkBuildManager', 'Updating {0} with {1}'.format(
+                _file, ', '.join(_change[1] for _change in changes)))
+            self.render_template(_file, OrderedDict(changes))
 
         return build_dir, vnfd, manifest
 
+    @TRACER.traced('generate_csar', 'csar')
     def generate_csar(self, csar_name: str, build_dir: str, vndf: str,
                       manifest: str, am_package_manager: str,
-                      light: bool):
-        docker_sock = '/var/run/docker.sock:/var/run/docker.sock'
+                      light: bool, output_dir: Optional[str] = None):
         command = [
-            'docker', 'run', '--rm',
-            '-v', '{0}:{0}'.format(build_dir),
-            '-v', docker_sock,
-            '-w', build_dir,
-            am_package_manager,
             'generate',
             '--helm3',
             '--helm-dir', join(build_dir, 'charts'),
@@ -1018,14 +3781,54 @@ class SdkBuildManager(Base):
 
         self.info('SdkBuildManager',
                   'Creating CSAR from {0} '.format(build_dir))
-        print(' '.join(command))
-        self._execute(command)
-
         sdk_csar = join(build_dir, '{0}.csar'.format(csar_name))
+        if self._csar_writer and light:
+            self._csar_writer.write(sdk_csar, self._csar_writer.layout(
+                build_dir, vndf, manifest))
+        else:
+            if self._csar_writer:
+                self.warn('SdkBuildManager', 'The native CSAR writer only '
+                                             'builds light CSARs, using the '
+                                             'package manager')
+            print(' '.join(command))
+            PackageManagerWorker(am_package_manager,
+                                 [output_dir or build_dir],
+                                 False).run(command, build_dir)
+
         if not exists(sdk_csar):
             raise FileNotFoundError('{0} not found!'.format(sdk_csar))
-        self._execute(['unzip', '-l', sdk_csar])
+        members = CsarWriter.verify(sdk_csar)
+        if not (self._csar_writer and light):
+            CsarIndex().save(sdk_csar)
+        for member in members:
+            self.debug('SdkBuildManager', '  {0:>12}  {1}'.format(
+                member.file_size, member.filename))
+        self.info('SdkBuildManager', 'Verified {0}: {1} members, {2} '
+                                     'uncompressed'.format(
+                                         sdk_csar, len(members),
+                                         self.format_size(sum(
+                                             _m.file_size
+                                             for _m in members))))
+
+    @TRACER.traced('chart_csars', 'csar')
+    def chart_csars(self, output_dir: str, csar_name: str,
+                    sdk_input_path: str, am_package_manager: str,
+                    light: bool, jobs: int = 1) -> None:
+        """
+        Build a CSAR for every chart archive in output_dir, up to jobs at a
+        time.
+        """
+        self._docker.preparecsar(
+            output_dir, csar_name, sdk_input_path, am_package_manager, light,
+            jobs, self._pm_worker)
 
+    def close(self) -> None:
+        """
+        Remove the staged blobs nothing links to any more.
+        """
+        self._docker.prune_blobs()
+
+    @TRACER.traced('rebuild_csar', 'csar')
     def rebuild_csar(self, chart_yaml: str, output_dir: str,
                      template: str, product_set: str, am_package_manager: str,
                      light: bool) -> None:
@@ -1037,7 +3840,7 @@ class SdkBuildManager(Base):
 
         self.generate_csar(
             '{0}-{1}'.format(_name, _version), build_dir, vndf, manifest,
-            am_package_manager, light)
+            am_package_manager, light, output_dir)
 
     @staticmethod
     def get_retagged_image(image, repository):
@@ -1065,6 +3868,7 @@ class SdkBuildManager(Base):
         else:
             return image
 
+    @TRACER.traced('load_csar_images', 'docker')
     def load_csar_images(self, repository: str, images_txt: str) -> None:
         if not exists(images_txt):
             raise SystemExit('File {0} not found'.format(images_txt))
@@ -1073,29 +3877,41 @@ class SdkBuildManager(Base):
                   'Load images from {0} and re-tag to {1}'.format(
                       docker_tar, repository))
 
-        docker = Docker()
-        docker.load_images(docker_tar)
+        docker = self._docker
+        index = docker.image_index(refresh=True)
+        with open(images_txt) as _reader:
+            images = [_image.strip() for _image in _reader.readlines()
+                      if _image.strip()]
+        missing = [_image for _image in images
+                   if not index.exists(_image) and not index.exists(
+                       self.get_retagged_image(_image, repository))]
+        docker.load_images(docker_tar, missing)
+        if missing:
+            index.refresh()
+
         retagged = []
         already = []
-        with open(images_txt) as _reader:
-            for image in _reader.readlines():
-                image = image.strip()
-                new_tag = self.get_retagged_image(image, repository)
-
-                if new_tag != image:
-                    retagged.append(new_tag)
-                    if docker.exists(new_tag):
-                        already.append(new_tag)
-                        self.info(
-                            'SdkBuildManager',
-                            'Image already re-tagged: {0}'.format(new_tag))
-                    else:
-                        docker.retag(image, new_tag)
+        loaded = []
+        pairs = []
+        for image in images:
+            new_tag = self.get_retagged_image(image, repository)
+
+            if new_tag != image:
+                retagged.append(new_tag)
+                if index.exists(new_tag):
+                    already.append(new_tag)
+                    self.info(
+                        'SdkBuildManager',
+                        'Image already re-tagged: {0}'.format(new_tag))
                 else:
-                    self.info('SdkBuildManager',
-                              'No need to re-tag {0}'.format(image))
-                if docker.exists(image):
-                    docker.remove([image])
+                    pairs.append((image, new_tag))
+            else:
+                self.info('SdkBuildManager',
+                          'No need to re-tag {0}'.format(image))
+            if index.exists(image):
+                loaded.append(image)
+        docker.retag_many(pairs)
+        docker.remove(loaded)
         docker.push_images(retagged)
 
     def load_am_package_manager(self, images_txt: str, repository: str):
@@ -1148,6 +3964,75 @@ def parse_args():
     parser.add_argument('--build-load-images', help='build-load-images help',
                         action='store_true')
     parser.add_argument('--sdk-path', help='SDK Chart template')
+    parser.add_argument('--trace-out',
+                        help='Write a Chrome trace-event timeline of the '
+                             'run to this file, viewable in Perfetto or '
+                             'chrome://tracing')
+    parser.add_argument('--command-log-dir',
+                        help='Also write the full output of every helm and '
+                             'docker command to its own file in this '
+                             'directory')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of custom charts to build in parallel '
+                             'with --build-load-images (default: 1)')
+    parser.add_argument('--cache', dest='use_cache',
+                        action='store_true', default=False,
+                        help='With --build-load-images, skip custom chart '
+                             'stages whose inputs did not change according '
+                             'to the stage cache in the output directory, '
+                             'reuse existing images with the same input '
+                             'digest and cached helm dependency and lint '
+                             'results (default: off)')
+    parser.add_argument('--no-cache', dest='use_cache',
+                        action='store_false',
+                        help='Rebuild every custom chart stage, the '
+                             'default')
+    parser.add_argument('--staging', choices=Staging.MODES, default='copy',
+                        help='How template files are staged into generated '
+                             'charts; link reflinks or hard links files '
+                             'instead of copying them (default: copy)')
+    parser.add_argument('--template-cache', nargs='?', default=None,
+                        const='~/.cenm_sdk/cache/templates',
+                        help='Keep extracted template archives for reuse, '
+                             'keyed by archive digest, in this directory '
+                             '(~/.cenm_sdk/cache/templates when no directory '
+                             'is given; default: off)')
+    parser.add_argument('--no-template-cache', dest='template_cache',
+                        action='store_const', const=None,
+                        help='Extract template archives on every run, the '
+                             'default')
+    parser.add_argument('--template-cache-size', type=int,
+                        default=Tar.CACHE_SIZE,
+                        help='Number of extracted template archives to keep '
+                             '(default: %(default)s)')
+    parser.add_argument('--chart-packager', choices=ChartPackager.PACKAGERS,
+                        default='helm',
+                        help='Package charts with helm package or with the '
+                             'built-in packager, which writes reproducible '
+                             'archives without starting helm; helm is used '
+                             'whenever helm package flags are configured '
+                             '(default: helm)')
+    parser.add_argument('--chart-compress-level', type=int,
+                        default=ChartPackager.COMPRESS_LEVEL,
+                        help='gzip level used by the built-in chart '
+                             'packager, 1-9 (default: %(default)s)')
+    parser.add_argument('--build-context', choices=BuildContext.MODES,
+                        default='full',
+                        help='Send docker the full chart folder, or only '
+                             'the files each Dockerfile copies, hard linked '
+                             'into a separate context directory; the full '
+                             'folder is also used when the Dockerfile cannot '
+                             'be analysed (default: full)')
+    parser.add_argument('--build-backend', choices=['build', 'bake'],
+                        default='build',
+                        help='Build images with one docker build per image, '
+                             'or all images of all charts with a single '
+                             'docker buildx bake; the driver, builder and '
+                             'local layer cache are set under buildx: bake: '
+                             'in ~/.cenm_sdk/config.yaml (default: build)')
+    parser.add_argument('--push-jobs', type=int, default=1,
+                        help='Number of docker images to push in parallel '
+                             '(default: 1)')
 
     integ_template = abspath(
         join(basename(__file__), '..', '..', 'templates',
@@ -1180,9 +4065,36 @@ def parse_args():
         help='ENM ProductSet the SDK Integration CSAR is targeting')
 
     parser.add_argument('--csar-name-version', help='csar-name-version help')
+    parser.add_argument('--chart-csars', action='store_true',
+                        help='Build one CSAR named --csar-name-version for '
+                             'every chart archive in --custom-sdk-path, each '
+                             'staged in its own directory under csar/')
+    parser.add_argument('--no-package-manager-worker',
+                        dest='package_manager_worker', action='store_false',
+                        default=True,
+                        help='Start a new package manager container for '
+                             'every CSAR instead of running them all with '
+                             'docker exec in one container')
+    parser.add_argument('--csar-jobs', type=int, default=1,
+                        help='Number of CSARs built at the same time with '
+                             '--chart-csars (default: 1)')
     parser.add_argument('--csar-light', help='Build a light version of '
                                              'the SDK CSAR',
                         action='store_true', default=False)
+    parser.add_argument('--diff-csar', nargs=2, metavar=('A', 'B'),
+                        type=lambda arg: _file_path(parser, '--diff-csar',
+                                                    arg),
+                        help='Compare the members of two CSARs, or of their '
+                             '.index.json files, by size and sha256; exits '
+                             'with 1 when they differ')
+    parser.add_argument('--csar-writer', choices=CsarWriter.WRITERS,
+                        default='package-manager',
+                        help='Write light CSARs with the package manager '
+                             'container or with the built-in writer, which '
+                             'compresses members in parallel without '
+                             'starting a container; full CSARs always use '
+                             'the package manager (default: '
+                             'package-manager)')
 
     if len(sys.argv) <= 1:
         parser.print_help()
@@ -1205,12 +4117,30 @@ def parse_args():
     check_option(__args.build_load_images, 'build-load-images',
                  __args.sdk_input_path, 'sdk-input-path')
 
+    if __args.jobs < 1:
+        parser.error('argument --jobs: must be at least 1')
+    if __args.csar_jobs < 1:
+        parser.error('argument --csar-jobs: must be at least 1')
+    if __args.push_jobs < 1:
+        parser.error('argument --push-jobs: must be at least 1')
+    if __args.template_cache_size < 1:
+        parser.error('argument --template-cache-size: must be at least 1')
+    if not 1 <= __args.chart_compress_level <= 9:
+        parser.error('argument --chart-compress-level: must be between '
+                     '1 and 9')
+
     check_option(__args.update_config, 'update-config',
                  __args.repository_url, 'repository-url')
 
     check_option(__args.rebuild_csar, 'rebuild-csar',
                  __args.custom_sdk_path, 'custom-sdk-path')
 
+    for _required, _name in [(__args.custom_sdk_path, 'custom-sdk-path'),
+                             (__args.sdk_input_path, 'sdk-input-path'),
+                             (__args.csar_name_version, 'csar-name-version'),
+                             (__args.repository_url, 'repository-url')]:
+        check_option(__args.chart_csars, 'chart-csars', _required, _name)
+
     check_option(__args.rebuild_csar, 'rebuild-csar',
                  __args.product_set, 'product_set')
 
@@ -1228,6 +4158,12 @@ def parse_args():
 
 
 if __name__ == '__main__':
+    _main_opts = parse_args()
+    VERBOSE = _main_opts.verbose
+    if _main_opts.diff_csar:
+        # comparing CSARs needs neither docker nor helm
+        exit(1 if CsarIndex().diff(*_main_opts.diff_csar) else 0)
+
     binaries = ['docker', 'helm']
     _b = False
     for binary in binaries:
@@ -1238,25 +4174,50 @@ if __name__ == '__main__':
     if _b:
         exit(3)
 
-    _main_opts = parse_args()
-    VERBOSE = _main_opts.verbose
-
-    build_mgr = SdkBuildManager()
-    if _main_opts.load_csar_images:
-        build_mgr.load_csar_images(_main_opts.repository_url,
-                                   _main_opts.sdk_images)
-    if _main_opts.build_load_images:
-        build_mgr.generate_chart(
-            _main_opts.sdk_path, _main_opts.sdk_input_path,
-            _main_opts.repository_url, _main_opts.custom_sdk_path,
-            _main_opts.overwrite)
-    if _main_opts.rebuild_csar:
-        _am_package_manager = build_mgr.get_am_package_manager_image(
-            _main_opts.repository_url, _main_opts.sdk_images
-        )
-        build_mgr.rebuild_csar(_main_opts.rebuild_csar,
-                               _main_opts.custom_sdk_path,
-                               _main_opts.integ_sdk_path,
-                               _main_opts.product_set,
-                               _am_package_manager,
-                               _main_opts.csar_light)
+    COMMAND_LOG_DIR = _main_opts.command_log_dir
+    if _main_opts.trace_out:
+        TRACER.enable(_main_opts.trace_out)
+
+    build_mgr = SdkBuildManager(_main_opts.push_jobs, _main_opts.use_cache,
+                                _main_opts.staging, _main_opts.template_cache,
+                                _main_opts.template_cache_size,
+                                _main_opts.chart_packager,
+                                _main_opts.chart_compress_level,
+                                _main_opts.build_context,
+                                _main_opts.build_backend,
+                                _main_opts.csar_writer,
+                                _main_opts.package_manager_worker)
+    try:
+        if _main_opts.load_csar_images:
+            build_mgr.load_csar_images(_main_opts.repository_url,
+                                       _main_opts.sdk_images)
+        if _main_opts.build_load_images:
+            build_mgr.generate_chart(
+                _main_opts.sdk_path, _main_opts.sdk_input_path,
+                _main_opts.repository_url, _main_opts.custom_sdk_path,
+                _main_opts.overwrite, _main_opts.jobs, _main_opts.use_cache)
+        if _main_opts.rebuild_csar:
+            _am_package_manager = None
+            if _main_opts.csar_writer != 'native' or \
+                    not _main_opts.csar_light:
+                _am_package_manager = build_mgr.get_am_package_manager_image(
+                    _main_opts.repository_url, _main_opts.sdk_images
+                )
+            build_mgr.rebuild_csar(_main_opts.rebuild_csar,
+                                   _main_opts.custom_sdk_path,
+                                   _main_opts.integ_sdk_path,
+                                   _main_opts.product_set,
+                                   _am_package_manager,
+                                   _main_opts.csar_light)
+        if _main_opts.chart_csars:
+            build_mgr.chart_csars(
+                _main_opts.custom_sdk_path, _main_opts.csar_name_version,
+                _main_opts.sdk_input_path,
+                build_mgr.get_am_package_manager_image(
+                    _main_opts.repository_url, _main_opts.sdk_images),
+                _main_opts.csar_light, _main_opts.csar_jobs)
+    finally:
+        build_mgr.close()
+        TRACER.save()
+
+    DOCUMENT_CACHE.report()
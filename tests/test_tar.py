@@ -0,0 +1,51 @@
+import os
+import sys
+import tarfile
+from os.path import abspath, dirname, isfile, join
+
+import pytest
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'src'))
+
+from sdkBuildManager import Tar  # noqa: E402
+
+
+def _dot_rooted_tgz(tmp_path):
+    source = tmp_path / 'source'
+    (source / 'fmsdk' / 'chart').mkdir(parents=True)
+    (source / 'fmsdk' / 'chart' / 'Chart.yaml').write_text('name: chart\n')
+    archive = str(tmp_path / 'templates.tgz')
+    # Same layout as "tar -C source -czf templates.tgz ."
+    with tarfile.open(archive, 'w:gz') as _tgz:
+        _tgz.add(str(source), arcname='.')
+    return archive
+
+
+def test_extract_dot_rooted_archive(tmp_path):
+    archive = _dot_rooted_tgz(tmp_path)
+    with tarfile.open(archive) as _tgz:
+        assert _tgz.getnames()[0] == '.'
+
+    root = Tar().extract_tar(archive, overwrite=True)
+    assert root == join(str(tmp_path), 'fmsdk')
+    assert isfile(join(root, 'chart', 'Chart.yaml'))
+
+
+def test_extract_dot_rooted_archive_cached(tmp_path):
+    archive = _dot_rooted_tgz(tmp_path)
+    cache = Tar(cache_dir=str(tmp_path / 'cache'))
+
+    root = cache.extract_tar(archive, overwrite=True)
+    assert os.path.basename(root) == 'fmsdk'
+    assert isfile(join(root, 'chart', 'Chart.yaml'))
+    assert cache.extract_tar(archive, overwrite=True) == root
+
+
+def test_extract_archive_without_named_entry(tmp_path):
+    (tmp_path / 'source').mkdir()
+    archive = str(tmp_path / 'empty.tgz')
+    with tarfile.open(archive, 'w:gz') as _tgz:
+        _tgz.add(str(tmp_path / 'source'), arcname='.')
+
+    with pytest.raises(ValueError, match='empty.tgz'):
+        Tar().extract_tar(archive, overwrite=True)